@@ -1,12 +1,15 @@
 from datetime import datetime
 
-from data_scraper import convert_runtime
-
 import tkinter as tk
 from ttkthemes import ThemedTk
 from tkinter import ttk, messagebox
-from film_list import FilmList
+from metrics import timed
+from query_executor import QueryExecutor
 from user_handler import UserHandler
+from user_storage import open_user_storage
+
+
+SEARCH_DEBOUNCE_MS = 150
 
 
 class FilmExplorerApp:
@@ -17,12 +20,25 @@ class FilmExplorerApp:
         self.root.iconphoto(False, icon)
         self.root.minsize(800, 500)
 
-        self.film_list = FilmList()
-        self.filtered_list = self.film_list.film_data.copy()
+        # the catalog is the first query executor job, so it loads while the login window is shown and every
+        # later query waits for it only if it is not ready yet
+        self.film_list = None
+        self.query_executor = QueryExecutor(self.root)
+        self.query_executor.submit(self.load_film_list, on_error=self.show_catalog_error)
 
-        self.user_handler = UserHandler()
+        self.user_handler = UserHandler(storage=open_user_storage())
         self.login_menu()
 
+    def load_film_list(self):
+        # pandas and the catalog modules are imported here, off the Tk thread, instead of before the first window
+        from film_list import FilmList
+        self.film_list = FilmList(compact=True)
+        self.filtered_list = self.film_list.film_data
+
+    def show_catalog_error(self, error):
+        messagebox.showerror("Catalog error", f'Could not load the film catalog\n{error}')
+        self.root.destroy()
+
     def login_menu(self):
         self.root.geometry("800x500")
         self.root.resizable(False, False)
@@ -45,13 +61,16 @@ class FilmExplorerApp:
         self.password_entry.bind('<Return>', self.login)
 
 
-        login_button = ttk.Button(self.login_frame, text="Login", command=self.login, width=20)
-        login_button.pack(side=tk.TOP, padx=5, pady=5, anchor=tk.CENTER)
+        self.login_button = ttk.Button(self.login_frame, text="Login", command=self.login, width=20)
+        self.login_button.pack(side=tk.TOP, padx=5, pady=5, anchor=tk.CENTER)
 
-        add_user_button = ttk.Button(self.login_frame, text="Login as new user",
-                                     command=lambda: self.login(as_new_user=True),
-                                     width=20)
-        add_user_button.pack(side=tk.TOP, padx=5, pady=5, anchor=tk.CENTER)
+        self.add_user_button = ttk.Button(self.login_frame, text="Login as new user",
+                                          command=lambda: self.login(as_new_user=True),
+                                          width=20)
+        self.add_user_button.pack(side=tk.TOP, padx=5, pady=5, anchor=tk.CENTER)
+
+        self.loading_label = ttk.Label(self.login_frame, text="")
+        self.loading_label.pack(side=tk.TOP, padx=5, pady=5)
 
     def login(self, event=None, as_new_user=False):
         self.username = self.username_var.get()
@@ -71,11 +90,19 @@ class FilmExplorerApp:
             messagebox.showerror("Wrong password", "Wrong password. Try again")
             return
 
-        list_to_watch, list_watched = self.user_handler.get_user_lists(self.username)
-        self.list_to_watch = self.film_list.get_by_films_index(list_to_watch)
-        self.list_watched = self.film_list.get_by_films_index(list_watched)
-
         messagebox.showinfo("Login", "Login Successful")
+
+        if self.film_list is None:
+            self.loading_label.config(text="Loading catalog...")
+            self.login_button.state(['disabled'])
+            self.add_user_button.state(['disabled'])
+            self.username_entry.unbind('<Return>')
+            self.password_entry.unbind('<Return>')
+
+        # the lists are resolved when their tab is shown, this job only waits for the catalog job queued before it
+        self.query_executor.submit(lambda: None, self.open_main_view)
+
+    def open_main_view(self, result=None):
         self.create_widgets()
         self.show_data(self.current_tree())
 
@@ -125,6 +152,7 @@ class FilmExplorerApp:
         self.search_entry = tk.Entry(search_frame, textvariable=self.search_var)
         self.search_entry.pack(side=tk.TOP, padx=10, pady=5, fill=tk.X, expand=True)
         self.search_entry.bind("<KeyRelease>", self.search)
+        self.title_search = self.film_list.search_session('Title')
 
         search_genre_frame = tk.Frame(self.main_frame)
         search_genre_frame.pack(fill=tk.X)
@@ -134,6 +162,7 @@ class FilmExplorerApp:
         self.genre_entry = tk.Entry(search_genre_frame, textvariable=self.genre_var)
         self.genre_entry.pack(side=tk.BOTTOM, padx=10, pady=5, fill=tk.X, expand=True)
         self.genre_entry.bind("<KeyRelease>", self.search)
+        self.genre_search = self.film_list.search_session('Genre')
 
         # ------------------------------------------------------------------
         # filters
@@ -196,7 +225,7 @@ class FilmExplorerApp:
         film_type = tk.StringVar()
         self.films_types = ttk.Combobox(filters_frame, textvariable=film_type)
 
-        self.films_types['values'] = self.film_list.film_data['Type'].unique().tolist()
+        self.films_types['values'] = self.film_list.category_indices['Type'].values.tolist()
         self.films_types.pack(side=tk.LEFT, padx=5, pady=5)
 
         ttk.Label(filters_frame, text="Language").pack(side=tk.LEFT)
@@ -204,7 +233,7 @@ class FilmExplorerApp:
         language_type = tk.StringVar()
         self.language_types = ttk.Combobox(filters_frame, textvariable=language_type)
 
-        self.language_types['values'] = sorted(self.film_list.film_data['Language'].unique().tolist())
+        self.language_types['values'] = sorted(self.film_list.category_indices['Language'].values.tolist())
         self.language_types.pack(side=tk.LEFT, padx=5, pady=5)
 
         # buttons
@@ -244,6 +273,7 @@ class FilmExplorerApp:
         self.tree_to_watch = ttk.Treeview(frame_to_watch, columns=head_columns, show='headings')
         self.tree_watched = ttk.Treeview(frame_watched, columns=head_columns, show='headings')
 
+        self.virtual_trees = {}
         self.create_film_tree(tree=self.tree_all)
         self.create_film_tree(tree=self.tree_to_watch)
         self.create_film_tree(tree=self.tree_watched)
@@ -308,6 +338,7 @@ class FilmExplorerApp:
         messagebox.showerror("Context Menu", "No films selected")
 
     def create_film_tree(self, tree):
+        from virtual_tree import VirtualTreeview
 
         tree.heading('Original Index', text='No.', command=lambda: self.sort_by_heading('Original Index', tree))
         tree.column('Original Index', width=25, anchor=tk.CENTER)
@@ -333,8 +364,8 @@ class FilmExplorerApp:
         tree.heading('Rating', text='Rating', command=lambda: self.sort_by_heading('Rating', tree))
         tree.column('Rating', width=25, anchor=tk.CENTER)
 
-        scrollbar = ttk.Scrollbar(tree, orient=tk.VERTICAL, command=tree.yview)
-        tree.configure(yscroll=scrollbar.set)
+        scrollbar = ttk.Scrollbar(tree, orient=tk.VERTICAL)
+        self.virtual_trees[tree] = VirtualTreeview(tree, scrollbar, self.film_list.get_row_values)
 
         scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         tree.pack(expand=True, fill=tk.BOTH)
@@ -348,25 +379,53 @@ class FilmExplorerApp:
             case 2:
                 return self.tree_watched
 
+    # self.filtered_list is only replaced inside query executor jobs, which run one at a time in submission
+    # order, so every query sees the list produced by the queries submitted before it
     def update_current_lists(self):
-        match self.notebook.index(self.notebook.select()):
+        tab = self.notebook.index(self.notebook.select())
+        list_to_watch, list_watched = self.user_handler.get_user_lists(self.username)
+        self.query_executor.submit(lambda: self.load_current_list(tab, list_to_watch, list_watched),
+                                   self.show_missing_films)
+
+    def load_current_list(self, tab, list_to_watch, list_watched):
+        match tab:
             case 0:
-                self.filtered_list = self.film_list.film_data.copy()
+                self.filtered_list = self.film_list.film_data
+                return tab, []
             case 1:
-                user_list, _ = self.user_handler.get_user_lists(self.username)
-                self.filtered_list = self.film_list.get_by_films_index(user_list)
+                rows, missing = self.film_list.resolve_films_index(list_to_watch)
             case 2:
-                _, user_list = self.user_handler.get_user_lists(self.username)
-                self.filtered_list = self.film_list.get_by_films_index(user_list)
+                rows, missing = self.film_list.resolve_films_index(list_watched)
+
+        self.filtered_list = self.film_list.select_rows(rows)
+        return tab, missing
+
+    def show_missing_films(self, result):
+        tab, missing = result
+        if not missing:
+            return
+
+        list_name = "To Watch" if tab == 1 else "Watched"
+        remove = messagebox.askyesno("Films not found",
+                                     f"{len(missing)} films in your \"{list_name}\" list are no longer in the "
+                                     f"catalog (No. {', '.join(map(str, missing))}).\nRemove them from the list?")
+        if not remove:
+            return
+
+        try:
+            for film_index in missing:
+                if tab == 1:
+                    self.user_handler.remove_to_watch(self.username, film_index)
+                else:
+                    self.user_handler.remove_watched(self.username, film_index)
+        except ValueError as e:
+            messagebox.showerror("Films not found", str(e))
 
     def tab_changed(self, event=None):
         self.update_current_lists()
         self.filter()
 
     def sort_by_heading(self, column, tree, event=None):
-        for item in tree.get_children():
-            tree.delete(item)
-
         if column == self.prev_sorted_column:
             self.is_ascending_sorting = not self.is_ascending_sorting
         else:
@@ -375,29 +434,34 @@ class FilmExplorerApp:
         self.prev_sorted_column = column
 
         tree.heading(column)
-        self.filtered_list = self.film_list.sort_by(column, ascending=self.is_ascending_sorting,
-                                                    film_data=self.filtered_list)
-        self.show_data()
+        ascending = self.is_ascending_sorting
+        self.query_executor.submit(lambda: self.sort_current_list(column, ascending), self.show_films)
+
+    def sort_current_list(self, column, ascending):
+        self.filtered_list = self.film_list.sort_by(column, ascending=ascending, film_data=self.filtered_list)
+        return self.filtered_list
 
     def search(self, event=None):
         query_title = self.search_var.get()
         query_genre = self.genre_var.get()
 
-        list_to_show = self.filtered_list.copy()
-        searched = False
+        self.query_executor.submit(lambda: self.search_current_list(query_title, query_genre), self.show_films,
+                                   key='search', delay_ms=SEARCH_DEBOUNCE_MS)
 
-        if query_title is not None or query_title != '':
-            searched = True
-            list_to_show = self.film_list.search_film(query_title, films=list_to_show)
+    def search_current_list(self, query_title, query_genre):
+        list_to_show = self.filtered_list
 
-        if query_genre is not None or query_genre != '':
-            searched = True
-            list_to_show = self.film_list.search_genre(query_genre, films=list_to_show)
+        if query_title:
+            list_to_show = self.film_list.select_rows(self.title_search.search(query_title), films=list_to_show)
 
-        if searched:
-            self.show_data(films=list_to_show)
+        if query_genre:
+            list_to_show = self.film_list.select_rows(self.genre_search.search(query_genre), films=list_to_show)
+
+        return list_to_show
 
     def filter(self, event=None):
+        from data_scraper import runtime_minutes
+
         try:
             date_from = datetime.strptime(self.date_from.get(), '%Y-%m-%d')
         except ValueError:
@@ -417,7 +481,7 @@ class FilmExplorerApp:
             date_to = None
 
         try:
-            runtime_from = convert_runtime(self.runtime_from.get())
+            runtime_from = runtime_minutes(self.runtime_from.get())
         except ValueError:
             if self.runtime_from.get() != '':
                 messagebox.showerror('Incorrect runtime format',
@@ -426,7 +490,7 @@ class FilmExplorerApp:
             runtime_from = None
 
         try:
-            runtime_to = convert_runtime(self.runtime_to.get())
+            runtime_to = runtime_minutes(self.runtime_to.get())
         except ValueError:
             if self.runtime_to.get() != '':
                 messagebox.showerror('Incorrect runtime format',
@@ -452,20 +516,25 @@ class FilmExplorerApp:
                                      'number')
             rating_to = 10.0
 
-        film_type = self.films_types.get()
-        language = self.language_types.get()
+        filters = dict(date_from=date_from, date_to=date_to,
+                       runtime_from=runtime_from, runtime_to=runtime_to,
+                       rating_from=rating_from, rating_to=rating_to,
+                       film_type=self.films_types.get(), language=self.language_types.get())
+        query_title = self.search_var.get()
+        query_genre = self.genre_var.get()
+
+        self.query_executor.submit(lambda: self.filter_current_list(filters, query_title, query_genre),
+                                   self.show_films, on_error=self.show_filter_error)
 
-        try:
-            self.filtered_list = self.film_list.filter_by(date_from=date_from, date_to=date_to,
-                                                          runtime_from=runtime_from, runtime_to=runtime_to,
-                                                          rating_from=rating_from, rating_to=rating_to,
-                                                          film_type=film_type, language=language,
-                                                          films=self.filtered_list)
-        except ValueError as e:
-            messagebox.showerror('Incorrect filters', f'Incorrect filters applied\n{e}')
-            return
+    def filter_current_list(self, filters, query_title, query_genre):
+        self.filtered_list = self.film_list.filter_by(films=self.filtered_list, **filters)
+        return self.search_current_list(query_title, query_genre)
 
-        self.search()
+    def show_filter_error(self, error):
+        if isinstance(error, ValueError):
+            messagebox.showerror('Incorrect filters', f'Incorrect filters applied\n{error}')
+        else:
+            messagebox.showerror('Filter error', f'Could not apply the filters\n{error}')
 
     def reset_filters(self, event=None):
         self.update_current_lists()
@@ -482,23 +551,17 @@ class FilmExplorerApp:
         self.prev_sorted_column = 'Release date'
         self.is_ascending_sorting = True
 
-        self.show_data()
+        self.query_executor.submit(lambda: self.filtered_list, self.show_films)
 
-    def show_data(self, event=None, films=None):
-        tree = self.current_tree()
-        for item in tree.get_children():
-            tree.delete(item)
+    def show_films(self, films):
+        self.show_data(films=films)
 
+    @timed('show_data', rows_in=lambda app, event=None, films=None: len(app.filtered_list if films is None else films))
+    def show_data(self, event=None, films=None):
         if films is None:
-            films = self.filtered_list.copy()
-
-        films['Release date'] = films['Release date'].apply(lambda date: date.strftime('%B %d, %Y'))
-        films['Runtime'] = films['Runtime'].apply(lambda td: f'{td.seconds // 3600} h {td.seconds // 60 % 60} min')
+            films = self.filtered_list
 
-        for _, row in films.iterrows():
-            tree.insert('', 'end', values=(row['Original Index'], row['Release date'],
-                                           row['Title'], row['Genre'], row['Runtime'], row['Language'],
-                                           row['Type'], row['Rating']))
+        self.virtual_trees[self.current_tree()].set_rows(films.index.to_numpy())
 
 
 if __name__ == "__main__":
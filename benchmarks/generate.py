@@ -0,0 +1,121 @@
+import os
+import json
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from data_scraper import FILM_DATA_PATH, parse_runtimes
+
+BENCHMARK_DATA_DIR = 'benchmarks/data'
+MAX_TITLE_WORDS = 8
+
+
+def load_reference(path=FILM_DATA_PATH):
+    reference = pd.read_csv(path)
+    reference['Release date'] = pd.to_datetime(reference['Release date'], format='%Y-%m-%d')
+    reference['Runtime'] = parse_runtimes(reference['Runtime'])
+    return reference
+
+
+def sample_values(rng, values: pd.Series, size: int):
+    # draws from the empirical distribution of the reference column, missing values included
+    frequencies = values.value_counts(dropna=False, normalize=True)
+    return frequencies.index.to_numpy()[rng.choice(len(frequencies), size=size, p=frequencies.to_numpy())]
+
+
+def generate_titles(rng, reference: pd.DataFrame, size: int):
+    words = reference['Title'].str.split()
+    vocabulary = words.explode().value_counts(normalize=True)
+    lengths = words.str.len().clip(upper=MAX_TITLE_WORDS).value_counts(normalize=True)
+
+    title_lengths = lengths.index.to_numpy()[rng.choice(len(lengths), size=size, p=lengths.to_numpy())]
+    vocabulary_words = vocabulary.index.to_numpy(dtype=object)
+
+    titles = vocabulary_words[rng.choice(len(vocabulary), size=size, p=vocabulary.to_numpy())]
+    for position in range(1, MAX_TITLE_WORDS):
+        next_words = vocabulary_words[rng.choice(len(vocabulary), size=size, p=vocabulary.to_numpy())]
+        longer = title_lengths > position
+        titles[longer] = titles[longer] + ' ' + next_words[longer]
+    return titles
+
+
+def generate_catalog(films: int, reference: pd.DataFrame, seed=0):
+    rng = np.random.default_rng(seed)
+
+    days = reference['Release date'].dropna().to_numpy().astype('datetime64[D]').astype(np.int64)
+    release_days = rng.integers(days.min(), days.max() + 1, size=films)
+
+    catalog = pd.DataFrame({
+        'Release date': pd.to_datetime(release_days, unit='D'),
+        'Title': generate_titles(rng, reference, films),
+        'Genre': sample_values(rng, reference['Genre'], films),
+        'Runtime': sample_values(rng, reference['Runtime'], films).astype('int16'),
+        'Language': sample_values(rng, reference['Language'], films),
+        'Type': sample_values(rng, reference['Type'], films),
+        'Rating': sample_values(rng, reference['Rating'], films).astype('float64'),
+    })
+
+    # the real catalog is ordered by release date, and Original Index follows that order
+    catalog = catalog.sort_values(['Release date', 'Title'], kind='stable', ignore_index=True)
+    catalog['Original Index'] = catalog.index
+    return catalog
+
+
+def generate_users(users: int, films: int, seed=0, mean_list_size=20):
+    rng = np.random.default_rng(seed)
+    to_watch_sizes = rng.geometric(1 / mean_list_size, size=users)
+    watched_sizes = rng.geometric(1 / mean_list_size, size=users)
+
+    generated = []
+    for user in range(users):
+        indices = rng.choice(films, size=min(films, to_watch_sizes[user] + watched_sizes[user]), replace=False)
+        split = min(len(indices), to_watch_sizes[user])
+        generated.append({'username': f'user{user:07d}',
+                          'password': f'password{user}',
+                          'to_watch': indices[:split].tolist(),
+                          'watched': indices[split:].tolist()})
+    return generated
+
+
+def catalog_path(films: int, data_dir=BENCHMARK_DATA_DIR):
+    return os.path.join(data_dir, f'films_{films}.csv')
+
+
+def users_path(users: int, films: int, data_dir=BENCHMARK_DATA_DIR):
+    return os.path.join(data_dir, f'users_{users}_{films}.json')
+
+
+def ensure_catalog(films: int, data_dir=BENCHMARK_DATA_DIR, seed=0, reference=None):
+    path = catalog_path(films, data_dir)
+    if not os.path.exists(path):
+        os.makedirs(data_dir, exist_ok=True)
+        print(f'Generating a catalog of {films} films...')
+        reference = load_reference() if reference is None else reference
+        generate_catalog(films, reference, seed).to_csv(path, index=False)
+    return path
+
+
+def ensure_users(users: int, films: int, data_dir=BENCHMARK_DATA_DIR, seed=0):
+    path = users_path(users, films, data_dir)
+    if not os.path.exists(path):
+        os.makedirs(data_dir, exist_ok=True)
+        print(f'Generating {users} users...')
+        with open(path, 'w') as file:
+            json.dump(generate_users(users, films, seed), file, indent=4)
+    return path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate synthetic catalogs and user files for the benchmarks')
+    parser.add_argument('--films', type=int, nargs='+', default=[1_000, 100_000])
+    parser.add_argument('--users', type=int, nargs='+', default=[1, 10_000])
+    parser.add_argument('--data-dir', default=BENCHMARK_DATA_DIR)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    reference = load_reference()
+    for film_count in args.films:
+        print(ensure_catalog(film_count, args.data_dir, args.seed, reference))
+        for user_count in args.users:
+            print(ensure_users(user_count, film_count, args.data_dir, args.seed))
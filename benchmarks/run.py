@@ -0,0 +1,218 @@
+import gc
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import statistics
+import subprocess
+from contextlib import redirect_stdout
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.generate import BENCHMARK_DATA_DIR, ensure_catalog, ensure_users, load_reference
+from film_list import FilmList, QueryCache
+from user_handler import UserHandler
+
+DEFAULT_REPEAT = 20
+DEFAULT_WARMUP = 2
+MIN_BENCHMARK_TIME = 0.2
+SEARCH_QUERIES = ('the', 'love', 'a', 'christmas')
+GENRE_QUERIES = ('drama', 'comedy')
+LIST_SIZES = (100, 10_000)
+
+
+def measure(function, repeat=DEFAULT_REPEAT, warmup=DEFAULT_WARMUP, min_time=MIN_BENCHMARK_TIME):
+    for _ in range(warmup):
+        function()
+
+    # the collector is paused so its pauses land between samples, not inside them
+    gc.collect()
+    gc.disable()
+    try:
+        samples = []
+        started = time.perf_counter()
+        while len(samples) < repeat or time.perf_counter() - started < min_time:
+            sample_started = time.perf_counter_ns()
+            function()
+            samples.append((time.perf_counter_ns() - sample_started) / 1e9)
+    finally:
+        gc.enable()
+
+    quartiles = np.percentile(samples, (25, 75))
+    return {'runs': len(samples),
+            'min_s': min(samples),
+            'median_s': statistics.median(samples),
+            'mean_s': statistics.fmean(samples),
+            'stdev_s': statistics.stdev(samples) if len(samples) > 1 else 0.0,
+            'iqr_s': float(quartiles[1] - quartiles[0]),
+            'p95_s': float(np.percentile(samples, 95))}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def open_tree():
+    try:
+        import tkinter as tk
+        from tkinter import ttk
+        from virtual_tree import VirtualTreeview
+        root = tk.Tk()
+    except Exception:
+        return None, None
+
+    tree = ttk.Treeview(root, columns=list(range(8)), show='headings', height=30)
+    scrollbar = ttk.Scrollbar(root, orient='vertical')
+    tree.pack()
+    root.update()
+    return root, lambda row_values: VirtualTreeview(tree, scrollbar, row_values)
+
+
+def query_cases(film_list: FilmList):
+    filtered = film_list.filter_by(rating_from=6.0)
+
+    cases = {}
+    for query in SEARCH_QUERIES:
+        cases[f'search_film[{query}]'] = lambda query=query: film_list.search_film(query)
+    for query in GENRE_QUERIES:
+        cases[f'search_genre[{query}]'] = lambda query=query: film_list.search_genre(query)
+
+    cases['filter_by[rating]'] = lambda: film_list.filter_by(rating_from=6.5, rating_to=8.0)
+    cases['filter_by[date,language]'] = lambda: film_list.filter_by(date_from=pd.Timestamp('2018-01-01'),
+                                                                      date_to=pd.Timestamp('2020-12-31'),
+                                                                      language='English')
+    cases['filter_by[type,runtime,subset]'] = lambda: film_list.filter_by(film_type='Documentaries',
+                                                                           runtime_from=60, runtime_to=120,
+                                                                           films=filtered)
+
+    cases['sort_by[Title]'] = lambda: film_list.sort_by('Title')
+    cases['sort_by[Rating,descending]'] = lambda: film_list.sort_by('Rating', ascending=False)
+    cases['sort_by[Release date,subset]'] = lambda: film_list.sort_by('Release date', film_data=filtered)
+    return cases
+
+
+def film_benchmarks(film_list: FilmList, repeat: int):
+    film_data = film_list.film_data
+    rng = np.random.default_rng(0)
+
+    # the same query runs on every sample, so the query cache is swapped for an empty one to time the queries
+    # themselves, and cache hits are timed as separate cases
+    query_cache = film_list.query_cache
+    film_list.query_cache = QueryCache(0)
+    try:
+        cases = query_cases(film_list)
+        results = {name: measure(case, repeat) for name, case in cases.items()}
+    finally:
+        film_list.query_cache = query_cache
+    results.update((f'{name}[cached]', measure(case, repeat)) for name, case in query_cases(film_list).items())
+
+    cases = {}
+    for size in LIST_SIZES:
+        indices = rng.choice(film_data['Original Index'].to_numpy(), size=min(size, len(film_data)),
+                             replace=False).tolist()
+        cases[f'get_by_films_index[{size}]'] = lambda indices=indices: film_list.get_by_films_index(indices)
+
+    results.update((name, measure(case, repeat)) for name, case in cases.items())
+
+    root, make_tree = open_tree()
+    if root is None:
+        print('No display available, skipping show_data', file=sys.stderr)
+    else:
+        virtual_tree = make_tree(film_list.get_row_values)
+        rows = film_data.index.to_numpy()
+
+        def show_data():
+            virtual_tree.set_rows(rows)
+            root.update_idletasks()
+
+        results['show_data'] = measure(show_data, repeat)
+        root.destroy()
+    return results
+
+
+def save_users_benchmark(users_path: str, repeat: int, work_dir: str):
+    path = f'{work_dir}/users_benchmark.json'
+    shutil.copyfile(users_path, path)
+    with redirect_stdout(sys.stderr):
+        user_handler = UserHandler(filepath=path)
+    return measure(user_handler.save_users, repeat, warmup=1)
+
+
+def run(films_sizes, users_sizes, repeat=DEFAULT_REPEAT, data_dir=BENCHMARK_DATA_DIR, compact=False):
+    reference = load_reference()
+    report = {'meta': {'commit': git_commit(),
+                       'python': platform.python_version(),
+                       'numpy': np.__version__,
+                       'pandas': pd.__version__,
+                       'platform': platform.platform(),
+                       'repeat': repeat,
+                       'compact': compact},
+              'results': [],
+              'memory': []}
+
+    for films in films_sizes:
+        path = ensure_catalog(films, data_dir, reference=reference)
+
+        with redirect_stdout(sys.stderr):
+            FilmList(path, compact=compact)
+        load = measure(lambda: FilmList(path, compact=compact), repeat=3, warmup=0, min_time=0)
+        report['results'].append({'name': 'FilmList()', 'films': films, 'stats': load})
+
+        with redirect_stdout(sys.stderr):
+            film_list = FilmList(path, compact=compact)
+        for name, stats in film_benchmarks(film_list, repeat).items():
+            report['results'].append({'name': name, 'films': films, 'stats': stats})
+        report['memory'].append({'films': films, **film_list.memory_report()})
+
+        for users in users_sizes:
+            users_file = ensure_users(users, films, data_dir)
+            report['results'].append({'name': 'save_users', 'films': films, 'users': users,
+                                      'stats': save_users_benchmark(users_file, repeat, data_dir)})
+    return report
+
+
+def compare(report: dict, baseline: dict):
+    def key(result):
+        return result['name'], result.get('films'), result.get('users')
+
+    baseline_results = {key(result): result for result in baseline['results']}
+    for result in report['results']:
+        previous = baseline_results.get(key(result))
+        if previous is None:
+            continue
+        ratio = result['stats']['median_s'] / previous['stats']['median_s']
+        print(f'{result["name"]:<36} films={result.get("films")!s:<9} users={result.get("users")!s:<8} '
+              f'{previous["stats"]["median_s"] * 1000:10.3f} ms -> {result["stats"]["median_s"] * 1000:10.3f} ms '
+              f'({ratio:.2f}x)', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the Film Explorer hot paths on synthetic catalogs')
+    parser.add_argument('--films', type=int, nargs='+', default=[1_000, 100_000])
+    parser.add_argument('--users', type=int, nargs='+', default=[1, 10_000])
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    parser.add_argument('--data-dir', default=BENCHMARK_DATA_DIR)
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    parser.add_argument('--compare', help='a previous JSON report to compare medians against')
+    parser.add_argument('--compact', action='store_true', help='benchmark the compact catalog representation')
+    args = parser.parse_args()
+
+    with redirect_stdout(sys.stderr):
+        result = run(args.films, args.users, args.repeat, args.data_dir, args.compact)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(result, file, indent=4)
+    else:
+        print(json.dumps(result, indent=4))
+
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            compare(result, json.load(file))
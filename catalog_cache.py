@@ -0,0 +1,135 @@
+import os
+import json
+import shutil
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+CACHE_VERSION = 3
+MANIFEST_NAME = 'manifest.json'
+
+STRING_COLUMNS = ('Title', 'Genre', 'Language', 'Type')
+DATE_COLUMNS = ('Release date',)
+
+
+def get_cache_dir(csv_path: str):
+    return csv_path + '.cache'
+
+
+def file_hash(path: str):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_catalog_cache(csv_path: str):
+    cache_dir = get_cache_dir(csv_path)
+    manifest = read_manifest(cache_dir)
+    if manifest is None or manifest.get('version') != CACHE_VERSION or not os.path.exists(csv_path):
+        return None
+
+    stat = os.stat(csv_path)
+    if stat.st_mtime_ns != manifest['mtime_ns'] or stat.st_size != manifest['size']:
+        if stat.st_size != manifest['size'] or file_hash(csv_path) != manifest['sha1']:
+            return None
+        # same content, only touched - remember the new mtime so the hash is not recomputed next time
+        manifest['mtime_ns'] = stat.st_mtime_ns
+        write_manifest(cache_dir, manifest)
+
+    try:
+        columns = {column['name']: load_column(cache_dir, column) for column in manifest['columns']}
+    except (OSError, ValueError, KeyError):
+        return None
+
+    return pd.DataFrame(columns)
+
+
+def save_catalog_cache(film_data: pd.DataFrame, csv_path: str):
+    cache_dir = get_cache_dir(csv_path)
+    tmp_dir = cache_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    stat = os.stat(csv_path)
+    manifest = {'version': CACHE_VERSION,
+                'mtime_ns': stat.st_mtime_ns,
+                'size': stat.st_size,
+                'sha1': file_hash(csv_path),
+                'rows': len(film_data),
+                'columns': [save_column(tmp_dir, i, name, film_data[name])
+                            for i, name in enumerate(film_data.columns)]}
+    write_manifest(tmp_dir, manifest)
+
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.replace(tmp_dir, cache_dir)
+
+
+def save_column(cache_dir: str, position: int, name: str, values: pd.Series):
+    column = {'name': name, 'file': f'{position}'}
+
+    if name in STRING_COLUMNS:
+        codes, uniques = pd.factorize(values)
+        column['kind'] = 'string'
+        np.save(os.path.join(cache_dir, f'{position}.codes.npy'), codes.astype(np.int32))
+        save_strings(cache_dir, position, uniques)
+    elif name in DATE_COLUMNS:
+        column['kind'] = 'date'
+        days = values.to_numpy(dtype='datetime64[ns]').astype('datetime64[D]').astype(np.int32)
+        np.save(os.path.join(cache_dir, f'{position}.npy'), days)
+    else:
+        column['kind'] = 'numeric'
+        np.save(os.path.join(cache_dir, f'{position}.npy'), values.to_numpy())
+
+    return column
+
+
+def load_column(cache_dir: str, column: dict):
+    position = column['file']
+
+    match column['kind']:
+        case 'string':
+            codes = np.load(os.path.join(cache_dir, f'{position}.codes.npy'), mmap_mode='r')
+            uniques = load_strings(cache_dir, position)
+            return pd.Series(pd.Index(uniques).take(codes, allow_fill=True, fill_value=np.nan))
+        case 'date':
+            days = np.load(os.path.join(cache_dir, f'{position}.npy'), mmap_mode='r')
+            return pd.Series(days.astype('datetime64[D]').astype('datetime64[ns]'))
+        case 'numeric':
+            return pd.Series(np.array(np.load(os.path.join(cache_dir, f'{position}.npy'), mmap_mode='r')))
+
+    raise ValueError(f'Unknown cache column kind {column["kind"]}')
+
+
+# distinct strings are stored as one UTF-8 buffer plus their character offsets in it, so a single long value
+# doesn't pad every other one to its length the way a fixed-width unicode array does
+def save_strings(cache_dir: str, position: int, values):
+    values = [str(value) for value in values]
+    offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in values], out=offsets[1:])
+    text = ''.join(values).encode('utf-8')
+    np.save(os.path.join(cache_dir, f'{position}.offsets.npy'), offsets)
+    np.save(os.path.join(cache_dir, f'{position}.strings.npy'), np.frombuffer(text, dtype=np.uint8))
+
+
+def load_strings(cache_dir: str, position: str):
+    offsets = np.load(os.path.join(cache_dir, f'{position}.offsets.npy')).tolist()
+    text = np.load(os.path.join(cache_dir, f'{position}.strings.npy')).tobytes().decode('utf-8')
+    return np.array([text[start:end] for start, end in zip(offsets[:-1], offsets[1:])], dtype=object)
+
+
+def read_manifest(cache_dir: str):
+    try:
+        with open(os.path.join(cache_dir, MANIFEST_NAME), 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def write_manifest(cache_dir: str, manifest: dict):
+    path = os.path.join(cache_dir, MANIFEST_NAME)
+    with open(path + '.tmp', 'w') as file:
+        json.dump(manifest, file)
+    os.replace(path + '.tmp', path)
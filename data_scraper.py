@@ -1,68 +1,194 @@
 import os
-from io import StringIO
-import gzip
-import shutil
-import requests
-from bs4 import BeautifulSoup
+import csv
+import argparse
+import numpy as np
 import pandas as pd
 import re
 from datetime import timedelta
-
-
-def get_film_data():
-    if not os.path.exists("resources/data_scraper/full_film_data.csv"):
+from email.utils import formatdate
+
+from catalog_cache import load_catalog_cache, save_catalog_cache
+from metrics import timed, stage
+
+DATA_DIR = 'resources/data_scraper'
+FILM_DATA_PATH = 'resources/data_scraper/full_film_data.csv'
+FILM_RATINGS_PATH = 'resources/data_scraper/films_ratings.csv'
+
+IMDB_DATASETS_URL = 'https://datasets.imdbws.com/'
+IMDB_CHUNK_SIZE = 500_000
+FILM_TITLE_TYPES = ('movie', 'tvMovie', 'tvSpecial', 'video', 'short', 'tvShort')
+MIN_START_YEAR = 2015
+WIKI_FILM_LIST_URLS = ["https://en.wikipedia.org/wiki/List_of_Netflix_original_films_(2015–2017)",
+                       "https://en.wikipedia.org/wiki/List_of_Netflix_original_films_(2018)",
+                       "https://en.wikipedia.org/wiki/List_of_Netflix_original_films_(2019)",
+                       "https://en.wikipedia.org/wiki/List_of_Netflix_original_films_(2020)",
+                       "https://en.wikipedia.org/wiki/List_of_Netflix_original_films_(2021)",
+                       "https://en.wikipedia.org/wiki/List_of_Netflix_original_films_(2022)",
+                       "https://en.wikipedia.org/wiki/List_of_Netflix_original_films_(2023)"]
+RUNTIME_PATTERN = r"^(?:0 days\s+)?(\d+):(\d+):(\d+)$|^(?:(\d+)\s*h\s*)?(?:(\d+)\s*min)?$"
+
+
+@timed('get_film_data', rows_out=len)
+def get_film_data(path=FILM_DATA_PATH):
+    if not os.path.exists(path):
         ratings = get_film_ratings()
         wiki_films = get_wiki_films()
 
-        print('Merging film data...')
+        films_data_avg_rate = merge_film_data(wiki_films, ratings)
+        films_data_avg_rate['Original Index'] = films_data_avg_rate.index
 
-        wiki_films['Year'] = wiki_films['Release date'].dt.year.astype(str)
+        write_csv_atomic(films_data_avg_rate, path)
+        update_film_data_cache(films_data_avg_rate, path)
 
-        ratings = ratings[['primaryTitle', 'startYear', 'averageRating', 'numVotes']]
+        return films_data_avg_rate
+    else:
+        with stage('load_catalog_cache'):
+            film_data = load_catalog_cache(path)
+        if film_data is not None:
+            print("Loading cached films data...")
+            return film_data
 
-        films_data = pd.merge(wiki_films, ratings, how='left', left_on=['Title', 'Year'],
-                              right_on=['primaryTitle', 'startYear'])
-        films_data.drop(columns=['primaryTitle', 'startYear', 'Year'], inplace=True)
+        print("Reading films data...")
+        with stage('read_catalog_csv'):
+            film_data = pd.read_csv(path)
+            film_data['Release date'] = pd.to_datetime(film_data['Release date'], format='%Y-%m-%d')
+            film_data['Runtime'] = parse_runtimes(film_data['Runtime'])
+        update_film_data_cache(film_data, path)
+        return film_data
 
-        films_data['weighted_rating'] = films_data['averageRating'] * films_data['numVotes']
 
-        films_data_avg_rate = films_data.groupby(['Release date', 'Title', 'Genre', 'Runtime', 'Language', 'Type']).agg(
-            {
-                'Release date': 'first',
-                'Title': 'first',
-                'Genre': 'first',
-                'Runtime': 'first',
-                'Language': 'first',
-                'Type': 'first',
-                'numVotes': 'sum',
-                'weighted_rating': 'sum'
-            })
+@timed('merge_film_data', rows_in=lambda wiki_films, ratings: len(wiki_films), rows_out=len)
+def merge_film_data(wiki_films, ratings):
+    print('Merging film data...')
 
-        print(films_data_avg_rate.info())
-        films_data_avg_rate['Rating'] = films_data_avg_rate['weighted_rating'] / films_data_avg_rate['numVotes']
+    # one catalog row per distinct film, in the order the old groupby over these columns produced
+    film_columns = ['Release date', 'Title', 'Genre', 'Runtime', 'Language', 'Type']
+    films_data = wiki_films[film_columns].dropna().drop_duplicates()
+    films_data = films_data.sort_values(film_columns, kind='stable', ignore_index=True)
 
-        films_data_avg_rate.drop(columns=['numVotes', 'weighted_rating'], inplace=True)
-        films_data_avg_rate['Rating'] = films_data_avg_rate['Rating'].round(decimals=1)
+    rating_index = RatingIndex(ratings)
+    films_data['Rating'] = rating_index.lookup(films_data['Title'], films_data['Release date'].dt.year)
+    films_data['Rating'] = films_data['Rating'].round(decimals=1)
+    print(f"Found ratings for {films_data['Rating'].notna().sum()} of {len(films_data)} films")
 
-        films_data_avg_rate.reset_index(drop=True, inplace=True)
-        films_data_avg_rate['Original Index'] = films_data_avg_rate.index
+    films_data['Runtime'] = parse_runtimes(films_data['Runtime'])
+    return films_data
 
-        films_data_avg_rate['Runtime'] = films_data_avg_rate['Runtime'].apply(convert_runtime)
 
-        films_data_avg_rate.to_csv('resources/data_scraper/full_film_data.csv', index=False)
+def normalize_titles(titles: pd.Series):
+    # decomposed accents are combining marks, which the punctuation pattern drops along with the punctuation
+    titles = titles.astype('str').str.normalize('NFKD').str.casefold()
+    titles = titles.str.replace(r"[^\w\s]|_", '', regex=True)
+    return titles.str.replace(r"\s+", ' ', regex=True).str.strip()
 
-        return films_data_avg_rate
-    else:
-        print("Reading films data...")
-        film_data = pd.read_csv('resources/data_scraper/full_film_data.csv')
-        film_data['Release date'] = pd.to_datetime(film_data['Release date'], format='%Y-%m-%d')
-        film_data['Runtime'] = film_data['Runtime'].apply(convert_runtime)
-        return film_data
+
+def rating_keys(titles: pd.Series, years: pd.Series):
+    return normalize_titles(titles) + '|' + years.astype('Int64').astype('str')
+
+
+class RatingIndex:
+    def __init__(self, ratings: pd.DataFrame):
+        years = pd.to_numeric(ratings['startYear'], errors='coerce')
+        valid = ratings['primaryTitle'].notna() & years.notna() & ratings['numVotes'].gt(0)
+        ratings = ratings[valid]
+
+        # the vote-weighted rating of a key is its total weighted rating over its total votes
+        totals = pd.DataFrame({'key': rating_keys(ratings['primaryTitle'], years[valid]),
+                               'weighted_rating': ratings['averageRating'] * ratings['numVotes'],
+                               'numVotes': ratings['numVotes'].astype('int64')})
+        totals = totals.groupby('key', sort=False).sum()
+
+        self.keys = pd.Index(totals.index)
+        self.ratings = (totals['weighted_rating'] / totals['numVotes']).to_numpy()
+
+    def lookup(self, titles: pd.Series, years: pd.Series):
+        positions = self.keys.get_indexer(rating_keys(titles, years))
+        ratings = np.append(self.ratings, np.nan)[positions]
+        return pd.Series(ratings, index=titles.index, dtype='float64')
+
+
+# films are matched on (Title, Release date) plus their position among films sharing that key, so the
+# Original Index stored in user lists keeps pointing at the same film after a refresh
+def film_keys(film_data):
+    occurrence = film_data.groupby(['Title', 'Release date'], sort=False, dropna=False).cumcount()
+    return pd.MultiIndex.from_arrays([film_data['Title'], film_data['Release date'], occurrence])
+
+
+@timed('refresh_film_data', rows_out=len)
+def refresh_film_data(path=FILM_DATA_PATH):
+    if not os.path.exists(path):
+        return get_film_data(path)
+
+    film_data = get_film_data(path)
+    film_data = film_data.sort_values('Original Index', kind='stable', ignore_index=True)
+    ratings = get_film_ratings(refresh=True)
+    wiki_films = get_wiki_films(refresh=True)
+    fresh_data = merge_film_data(wiki_films, ratings)
+
+    keys = film_keys(film_data)
+    fresh_keys = film_keys(fresh_data)
+    positions = keys.get_indexer(fresh_keys)
+    matched = positions >= 0
+
+    old_ratings = film_data['Rating'].to_numpy()[positions[matched]]
+    new_ratings = fresh_data['Rating'].to_numpy()[matched]
+    changed = ~((old_ratings == new_ratings) | (pd.isna(old_ratings) & pd.isna(new_ratings)))
+    film_data.loc[positions[matched][changed], 'Rating'] = new_ratings[changed]
+
+    new_films = fresh_data[~matched].reset_index(drop=True)
+    next_index = int(film_data['Original Index'].max()) + 1 if len(film_data) else 0
+    new_films['Original Index'] = np.arange(next_index, next_index + len(new_films))
+    if len(new_films):
+        film_data = pd.concat([film_data, new_films[film_data.columns]], ignore_index=True)
+
+    print(f'Added {len(new_films)} films and updated {int(changed.sum())} ratings')
+    if len(new_films) or changed.any():
+        write_csv_atomic(film_data, path)
+        update_film_data_cache(film_data, path)
+    return film_data
+
+
+@timed('write_catalog_csv', rows_in=lambda film_data, path: len(film_data), bytes_written=lambda size: size)
+def write_csv_atomic(film_data, path):
+    tmp_path = path + '.tmp'
+    film_data.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    return os.path.getsize(path)
+
+
+@timed('save_catalog_cache', rows_in=lambda film_data, path: len(film_data))
+def update_film_data_cache(film_data, path):
+    try:
+        save_catalog_cache(film_data, path)
+    except OSError as e:
+        print(f'Could not write films data cache: {e}')
+
+
+def parse_runtimes(runtimes: pd.Series):
+    # catalogs built since runtimes are stored as minutes read back as plain integers
+    if pd.api.types.is_numeric_dtype(runtimes):
+        return runtimes.astype('int16')
+
+    runtimes = runtimes.astype(str).str.strip()
+
+    matched = runtimes.str.match(RUNTIME_PATTERN)
+    if not matched.all():
+        raise ValueError(f"Time format is incorrect: {runtimes[~matched].iloc[0]}")
+
+    parts = runtimes.str.extract(RUNTIME_PATTERN).fillna(0).astype('int32')
+    clock_minutes = parts[0] * 60 + parts[1] + parts[2] // 60
+    text_minutes = parts[3] * 60 + parts[4]
+
+    minutes = clock_minutes.where(runtimes.str.contains(':', regex=False), text_minutes)
+    return minutes.astype('int16')
+
+
+def runtime_minutes(runtime_str: str):
+    return int(convert_runtime(runtime_str).total_seconds()) // 60
 
 
 def convert_runtime(runtime_str: str):
-    pattern = r"^(?:0 days\s+)?(\d+):(\d+):(\d+)$|^(?:(\d+)\s*h\s*)?(?:(\d+)\s*min)?$"
-    match = re.match(pattern, runtime_str.strip())
+    match = re.match(RUNTIME_PATTERN, runtime_str.strip())
 
     if match:
         if match.group(1):
@@ -79,79 +205,102 @@ def convert_runtime(runtime_str: str):
         raise ValueError(f"Time format is incorrect: {runtime_str}")
 
 
-def get_film_ratings():
-    if not os.path.exists('resources/data_scraper/title.basics.tsv'):
-        print('Downloading and unpacking title.basics.tsv...')
+@timed('get_film_ratings', rows_out=len)
+def get_film_ratings(refresh=False):
+    if refresh or not os.path.exists(FILM_RATINGS_PATH):
+        basics_path = download_imdb_dataset('title.basics.tsv.gz', refresh)
+        ratings_path = download_imdb_dataset('title.ratings.tsv.gz', refresh)
 
-        response = requests.get('https://datasets.imdbws.com/title.basics.tsv.gz', stream=True)
-        with open('title.basics.tsv.gz', 'wb') as out_file:
-            shutil.copyfileobj(response.raw, out_file)
-        del response
+        if not is_newer(FILM_RATINGS_PATH, basics_path, ratings_path):
+            print('Merging IMDB data...')
+            films_ratings = read_imdb_films(basics_path, read_imdb_ratings(ratings_path))
+            films_ratings.to_csv(FILM_RATINGS_PATH, index=False)
 
-        with gzip.open('title.basics.tsv.gz', 'rb') as f_in:
-            with open('resources/data_scraper/title.basics.tsv', 'wb') as f_out:
-                shutil.copyfileobj(f_in, f_out)
+            return films_ratings
 
-        os.remove('title.basics.tsv.gz')
+    print('Loading IMDB data...')
+    return pd.read_csv(FILM_RATINGS_PATH, dtype={'startYear': str})
 
-    if not os.path.exists('resources/data_scraper/title.ratings.tsv'):
-        print('Downloading and unpacking title.ratings.tsv...')
 
-        response = requests.get('https://datasets.imdbws.com/title.ratings.tsv.gz', stream=True)
-        with open('title.ratings.tsv.gz', 'wb') as out_file:
-            shutil.copyfileobj(response.raw, out_file)
-        del response
+def is_newer(path: str, *sources):
+    return os.path.exists(path) and all(os.path.getmtime(path) >= os.path.getmtime(source) for source in sources)
 
-        with gzip.open('title.ratings.tsv.gz', 'rb') as f_in:
-            with open('resources/data_scraper/title.ratings.tsv', 'wb') as f_out:
-                shutil.copyfileobj(f_in, f_out)
 
-        os.remove('title.ratings.tsv.gz')
+@timed('download_imdb_dataset')
+def download_imdb_dataset(file_name: str, refresh=False):
+    # older builds kept the unpacked dump, read it if it is still there
+    unpacked_path = os.path.join(DATA_DIR, file_name.removesuffix('.gz'))
+    if os.path.exists(unpacked_path) and not refresh:
+        return unpacked_path
 
-    if not os.path.exists('resources/data_scraper/films_ratings.csv'):
-        print('Merging IMDB data...')
-        titles = pd.read_csv('resources/data_scraper/title.basics.tsv', sep='\t')
-        ratings = pd.read_csv('resources/data_scraper/title.ratings.tsv', sep='\t')
+    path = os.path.join(DATA_DIR, file_name)
+    if refresh or not os.path.exists(path):
+        # the local copy's mtime is when it was downloaded, the server only sends the dump again if it is newer
+        headers = {}
+        if os.path.exists(path):
+            headers['If-Modified-Since'] = formatdate(os.path.getmtime(path), usegmt=True)
 
-        films_ratings = pd.merge(titles, ratings, how='inner')
-        films_ratings.to_csv('resources/data_scraper/films_ratings.csv', index=False)
+        # requests is only needed when a dump is actually downloaded, so loading a built catalog never imports it
+        import requests
+        response = requests.get(IMDB_DATASETS_URL + file_name, headers=headers, stream=True)
+        if response.status_code == 304:
+            print(f'{file_name} is up to date')
+            return path
+        response.raise_for_status()
 
-        return films_ratings
-    else:
-        print('Loading IMDB data...')
-        return pd.read_csv('resources/data_scraper/films_ratings.csv')
+        print(f'Downloading {file_name}...')
+        with open(path + '.part', 'wb') as out_file:
+            for block in response.iter_content(chunk_size=1 << 20):
+                out_file.write(block)
+        os.replace(path + '.part', path)
 
+    return path
+
+
+def read_imdb_tsv(path: str, columns: list, dtypes: dict, chunksize=None):
+    return pd.read_csv(path, sep='\t', usecols=columns, dtype=dtypes, na_values='\\N', keep_default_na=False,
+                       quoting=csv.QUOTE_NONE, chunksize=chunksize)
+
+
+def parse_tconst(tconst: pd.Series):
+    return tconst.str.slice(2).astype('int32')
 
-def get_wiki_films():
-    if not os.path.exists('resources/data_scraper/netflix_wiki.csv'):
-        print('Scraping Wikipedia...')
 
-        urls = ["https://en.wikipedia.org/wiki/List_of_Netflix_original_films_(2015–2017)",
-                "https://en.wikipedia.org/wiki/List_of_Netflix_original_films_(2018)",
-                "https://en.wikipedia.org/wiki/List_of_Netflix_original_films_(2019)",
-                "https://en.wikipedia.org/wiki/List_of_Netflix_original_films_(2020)",
-                "https://en.wikipedia.org/wiki/List_of_Netflix_original_films_(2021)",
-                "https://en.wikipedia.org/wiki/List_of_Netflix_original_films_(2022)",
-                "https://en.wikipedia.org/wiki/List_of_Netflix_original_films_(2023)"]
+def read_imdb_ratings(path: str):
+    ratings = read_imdb_tsv(path, ['tconst', 'averageRating', 'numVotes'],
+                            {'tconst': str, 'averageRating': 'float64', 'numVotes': 'int32'})
+    ratings.index = parse_tconst(ratings.pop('tconst'))
+    return ratings
 
-        dataframes = []
-        for url in urls:
-            response = requests.get(url)
-            soup = BeautifulSoup(response.content, "html.parser")
 
-            tables = soup.find_all("table", {"class": "wikitable"})
+@timed('read_imdb_films', rows_in=lambda path, ratings: len(ratings), rows_out=len)
+def read_imdb_films(path: str, ratings: pd.DataFrame):
+    films = []
+    chunks = read_imdb_tsv(path, ['tconst', 'titleType', 'primaryTitle', 'startYear'],
+                           {'tconst': str, 'titleType': str, 'primaryTitle': str, 'startYear': str},
+                           chunksize=IMDB_CHUNK_SIZE)
 
-            for table in tables:
-                df = pd.read_html(StringIO(str(table)))[0]
+    # only the rated film-like titles released since the Netflix lists start can ever be joined,
+    # so everything else is dropped chunk by chunk before it accumulates
+    for chunk in chunks:
+        chunk = chunk[chunk['titleType'].isin(FILM_TITLE_TYPES)]
+        chunk = chunk[pd.to_numeric(chunk['startYear'], errors='coerce') >= MIN_START_YEAR]
+        chunk = chunk.assign(tconst=parse_tconst(chunk['tconst']))
+        films.append(chunk.join(ratings, on='tconst', how='inner'))
 
-                movie_type = table.find_previous('h2').find('span', class_='mw-headline').text
-                df['Type'] = movie_type
-                if movie_type == "Documentaries":
-                    df['Genre'] = 'Documentary'
+    films = pd.concat(films, ignore_index=True)
+    films['titleType'] = films['titleType'].astype('category')
+    return films
 
-                dataframes.append(df)
 
-        netflix_wiki = pd.concat(dataframes, ignore_index=True)
+@timed('get_wiki_films', rows_out=len)
+def get_wiki_films(urls=WIKI_FILM_LIST_URLS, refresh=False):
+    if refresh or not os.path.exists('resources/data_scraper/netflix_wiki.csv'):
+        print('Scraping Wikipedia...')
+        from http_cache import fetch_pages
+        from wiki_tables import parse_pages
+
+        netflix_wiki = parse_pages(fetch_pages(urls))
 
         netflix_wiki['Release date'] = pd.to_datetime(netflix_wiki['Release date'], format='%B %d, %Y')
 
@@ -162,3 +311,15 @@ def get_wiki_films():
         netflix_wiki['Release date'] = pd.to_datetime(netflix_wiki['Release date'], format='%Y-%m-%d')
 
     return netflix_wiki
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the film catalog, or refresh it in place')
+    parser.add_argument('--refresh', action='store_true',
+                        help='add new films and update changed ratings, keeping every Original Index')
+    args = parser.parse_args()
+
+    if args.refresh:
+        refresh_film_data()
+    else:
+        get_film_data()
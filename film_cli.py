@@ -0,0 +1,169 @@
+import sys
+import csv
+import json
+import time
+import argparse
+from contextlib import redirect_stdout
+
+import numpy as np
+
+import metrics
+from data_scraper import FILM_DATA_PATH
+from film_list import FilmList, DISPLAY_COLUMNS
+from film_query import FilmQuery, DEFAULT_LIMIT
+from user_handler import UserHandler
+from user_storage import open_user_storage, USERS_JSON_PATH, USERS_DB_PATH
+
+QUERY_FIELDS = ('action', 'title', 'genre', 'date_from', 'date_to', 'runtime_from', 'runtime_to', 'language',
+                'film_type', 'rating_from', 'rating_to', 'sort', 'offset', 'limit', 'user', 'password', 'list',
+                'index')
+
+
+class ResultWriter:
+    def __init__(self, out, output_format='jsonl'):
+        self.out = out
+        self.output_format = output_format
+        self.csv_writer = None
+
+    def write(self, result: dict):
+        if self.output_format == 'csv' and 'rows' in result:
+            if self.csv_writer is None:
+                self.csv_writer = csv.DictWriter(self.out, fieldnames=DISPLAY_COLUMNS)
+                self.csv_writer.writeheader()
+            self.csv_writer.writerows(result['rows'])
+        elif self.output_format == 'csv':
+            # only film rows fit the CSV columns, everything else goes to stderr
+            print(json.dumps(result), file=sys.stderr)
+        else:
+            self.out.write(json.dumps(result) + '\n')
+        self.out.flush()
+
+
+class QueryStats:
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.started = time.perf_counter()
+
+    def add(self, latency: float, failed: bool):
+        self.latencies.append(latency)
+        self.errors += failed
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started
+        latencies = np.array(self.latencies) * 1000
+        p50, p95, p99 = np.percentile(latencies, (50, 95, 99)) if len(latencies) else (0.0, 0.0, 0.0)
+        return {'queries': len(latencies), 'errors': self.errors, 'elapsed_s': round(elapsed, 3),
+                'queries_per_s': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+                'p50_ms': round(p50, 3), 'p95_ms': round(p95, 3), 'p99_ms': round(p99, 3)}
+
+
+def run_query(film_query: FilmQuery, query: dict):
+    try:
+        result = film_query.run(query)
+    except (ValueError, KeyError, TypeError) as error:
+        result = {'error': str(error) if not isinstance(error, KeyError) else f'Missing field {error}'}
+    if 'id' in query:
+        result = {'id': query['id'], **result}
+    return result
+
+
+def read_queries(lines):
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            query = json.loads(line)
+        except ValueError as error:
+            yield {'action': None, 'parse_error': f'Invalid JSON: {error}'}
+            continue
+
+        if isinstance(query, dict):
+            yield query
+        else:
+            yield {'action': None, 'parse_error': f'A query must be a JSON object, got {type(query).__name__}'}
+
+
+def query_from_args(args):
+    query = {field: getattr(args, field) for field in QUERY_FIELDS if getattr(args, field) is not None}
+    if args.descending:
+        query['ascending'] = False
+    return query
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run Film Explorer queries without the GUI')
+    parser.add_argument('--catalog', default=FILM_DATA_PATH)
+    parser.add_argument('--compact', action='store_true', help='keep the catalog in the compact representation')
+    parser.add_argument('--users-json', default=USERS_JSON_PATH)
+    parser.add_argument('--users-db', default=USERS_DB_PATH)
+    parser.add_argument('--format', choices=('jsonl', 'csv'), default='jsonl')
+    parser.add_argument('--stdin', action='store_true', help='read one JSON query per line until end of input')
+    parser.add_argument('--repeat', type=int, default=1, help='run the query from the arguments this many times')
+    parser.add_argument('--stats', action='store_true', help='print query throughput and latency to stderr')
+    parser.add_argument('--metrics', help='record metrics and write them here on exit (.prom for Prometheus text)')
+    parser.add_argument('--trace', help='append calls slower than --slow-ms to this JSON lines file')
+    parser.add_argument('--slow-ms', type=float, default=metrics.DEFAULT_SLOW_MS)
+
+    parser.add_argument('--action', choices=('films', 'reload', 'lists', 'add_user', 'remove_user',
+                                             'add_to_watch', 'remove_to_watch', 'add_watched', 'remove_watched',
+                                             'move_to_watched', 'move_to_towatch'))
+    parser.add_argument('--title')
+    parser.add_argument('--genre')
+    parser.add_argument('--date-from')
+    parser.add_argument('--date-to')
+    parser.add_argument('--runtime-from')
+    parser.add_argument('--runtime-to')
+    parser.add_argument('--language')
+    parser.add_argument('--film-type')
+    parser.add_argument('--rating-from', type=float)
+    parser.add_argument('--rating-to', type=float)
+    parser.add_argument('--sort')
+    parser.add_argument('--descending', action='store_true')
+    parser.add_argument('--offset', type=int)
+    parser.add_argument('--limit', type=int, help=f'rows per result, {DEFAULT_LIMIT} by default')
+    parser.add_argument('--user')
+    parser.add_argument('--password')
+    parser.add_argument('--list', choices=('to_watch', 'watched'))
+    parser.add_argument('--index', type=int)
+    args = parser.parse_args()
+
+    if args.metrics or args.trace:
+        metrics.enable(args.trace, args.slow_ms)
+
+    writer = ResultWriter(sys.stdout, args.format)
+    stats = QueryStats()
+
+    # progress messages from loading and from UserHandler must not end up between the results
+    with redirect_stdout(sys.stderr):
+        film_list = FilmList(args.catalog, compact=args.compact)
+        user_handler = UserHandler(storage=open_user_storage(args.users_json, args.users_db))
+        film_query = FilmQuery(film_list, user_handler)
+
+        if args.stdin:
+            queries = read_queries(sys.stdin)
+        else:
+            queries = (query_from_args(args) for _ in range(args.repeat))
+
+        stats.started = time.perf_counter()
+        for query in queries:
+            started = time.perf_counter()
+            if 'parse_error' in query:
+                result = {'error': query['parse_error']}
+            else:
+                result = run_query(film_query, query)
+            stats.add(time.perf_counter() - started, 'error' in result)
+            writer.write(result)
+
+        user_handler.close()
+
+    if args.stats:
+        print(json.dumps(stats.report()), file=sys.stderr)
+    if args.metrics:
+        metrics.export(args.metrics)
+    return 1 if stats.errors and not args.stdin else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,213 @@
+import numpy as np
+import pandas as pd
+
+CODEPOINT_BITS = 21
+BUILD_CHUNK_SIZE = 1 << 16
+SUBSET_GATHER_RATIO = 8
+
+
+def row_dtype(rows: int):
+    # row positions of catalogs below 2**31 rows fit in half the memory of the default intp
+    return np.int32 if rows < np.iinfo(np.int32).max else np.intp
+
+
+def intersect_sorted(smaller, larger):
+    positions = np.searchsorted(larger, smaller)
+    positions[positions == len(larger)] = 0
+    return smaller[larger[positions] == smaller] if len(larger) else larger
+
+
+class NgramIndex:
+    def __init__(self, values: pd.Series, n=3):
+        if not 1 <= n <= 3:
+            raise ValueError('N-gram length must be between 1 and 3')
+        self.n = n
+
+        codes, uniques = pd.factorize(values)
+        self.codes = codes
+        self.values = np.asarray(uniques, dtype=object)
+
+        order = np.argsort(codes, kind='stable')
+        order = order[codes[order] >= 0]
+        self.rows_by_value = order
+        self.value_starts = np.searchsorted(codes[order], np.arange(len(self.values) + 1))
+
+        # postings hold (value id, position) pairs packed as value_id << position_bits | position
+        self.position_bits = max(max(map(len, self.values), default=0), 1).bit_length()
+        self.gram_keys, self.posting_starts, self.postings = self.__build_postings()
+
+    def __build_postings(self):
+        keys, postings = [], []
+        for start in range(0, len(self.values), BUILD_CHUNK_SIZE):
+            chunk = np.array(self.values[start:start + BUILD_CHUNK_SIZE].tolist(), dtype=str)
+            width = chunk.dtype.itemsize // 4
+            if width == 0:
+                continue
+
+            # values are padded with n - 1 zero codepoints, so a gram starts at every character, including the
+            # last ones - a query shorter than n is then a prefix of the grams that start where it occurs
+            codepoints = np.zeros((len(chunk), width + self.n - 1), dtype=np.int64)
+            codepoints[:, :width] = chunk.view(np.uint32).reshape(len(chunk), width)
+            chunk_keys = self.__gram_keys(codepoints)
+            valid = codepoints[:, :width] != 0
+
+            value_ids = np.arange(start, start + len(chunk), dtype=np.int64)[:, None] << self.position_bits
+            chunk_postings = value_ids | np.arange(width, dtype=np.int64)
+            keys.append(chunk_keys[valid])
+            postings.append(chunk_postings[valid])
+
+        if not keys:
+            return np.empty(0, dtype=np.int64), np.zeros(1, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+        keys = np.concatenate(keys)
+        postings = np.concatenate(postings)
+        order = np.lexsort((postings, keys))
+        keys, postings = keys[order], postings[order]
+
+        gram_keys, starts = np.unique(keys, return_index=True)
+        return gram_keys, np.append(starts, len(keys)), postings
+
+    def __gram_keys(self, codepoints):
+        width = codepoints.shape[1] - self.n + 1
+        keys = np.zeros((codepoints.shape[0], width), dtype=np.int64)
+        for offset in range(self.n):
+            keys = (keys << CODEPOINT_BITS) | codepoints[:, offset:offset + width]
+        return keys
+
+    def __key_range(self, prefix: str):
+        # grams starting with prefix have consecutive keys, since the first character is in the highest bits
+        low = 0
+        for char in prefix:
+            low = (low << CODEPOINT_BITS) | ord(char)
+        shift = CODEPOINT_BITS * (self.n - len(prefix))
+        return np.searchsorted(self.gram_keys, [low << shift, (low + 1) << shift])
+
+    def __posting_list(self, gram: str):
+        first, last = self.__key_range(gram)
+        return self.postings[self.posting_starts[first]:self.posting_starts[last]]
+
+    def __value_ids(self, postings):
+        value_ids = postings >> self.position_bits
+        matches = np.zeros(len(self.values), dtype=bool)
+        matches[value_ids] = True
+        return np.flatnonzero(matches)
+
+    def search_values(self, query: str):
+        if query == '':
+            return np.arange(len(self.values))
+        if len(query) < self.n:
+            return self.__value_ids(self.__posting_list(query))
+
+        # grams at these offsets cover every character of the query, so a value matches exactly when it has each
+        # of them at its offset from the same start position
+        offsets = sorted(set(range(0, len(query) - self.n + 1, self.n)) | {len(query) - self.n})
+        posting_lists = sorted(((self.__posting_list(query[offset:offset + self.n]), offset) for offset in offsets),
+                               key=lambda posting_list: len(posting_list[0]))
+        position_mask = (1 << self.position_bits) - 1
+
+        # candidates are start positions, the other grams are looked up at start + offset
+        posting_list, offset = posting_lists[0]
+        candidates = posting_list[(posting_list & position_mask) >= offset] - offset
+        for posting_list, offset in posting_lists[1:]:
+            if len(candidates) == 0:
+                break
+            candidates = candidates[(candidates & position_mask) + offset <= position_mask]
+            found = intersect_sorted(candidates + offset, posting_list)
+            candidates = found - offset
+
+        value_ids = candidates >> self.position_bits
+        distinct = np.ones(len(value_ids), dtype=bool)
+        distinct[1:] = value_ids[1:] != value_ids[:-1]
+        return value_ids[distinct]
+
+    def search(self, query: str):
+        value_ids = self.search_values(query)
+
+        # gathering and sorting the rows of each value beats a pass over the codes up to about one row in 16
+        if len(value_ids) * 16 < len(self.codes):
+            starts = self.value_starts[value_ids]
+            counts = self.value_starts[value_ids + 1] - starts
+            positions = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+            return np.sort(self.rows_by_value[positions])
+
+        matches = np.zeros(len(self.values) + 1, dtype=bool)
+        matches[value_ids] = True
+        return np.flatnonzero(matches[self.codes])
+
+
+class SortIndex:
+    def __init__(self, values: pd.Series):
+        self.values = values
+        codes, uniques = pd.factorize(values, sort=True)
+        missing = len(uniques)
+        self.valid_count = int(np.count_nonzero(codes >= 0))
+
+        # equal values share a key and missing values get the largest key in both directions, keys of columns with
+        # fewer than 2**16 distinct values are 16 bit, which numpy's stable argsort orders with a radix sort
+        keys = np.uint16 if missing < np.iinfo(np.uint16).max else np.int32
+        self.ascending_keys = np.where(codes < 0, missing, codes).astype(keys)
+        self.descending_keys = np.where(codes < 0, missing, missing - 1 - codes).astype(keys)
+
+        rows = row_dtype(len(codes))
+        self.ascending_permutation = np.argsort(self.ascending_keys, kind='stable').astype(rows)
+        self.descending_permutation = self.__reverse_ties(self.ascending_permutation)
+        self.sorted_values = None
+
+    def __reverse_ties(self, ascending_permutation):
+        # the descending order lists the groups of equal values backwards, each group keeping its rows in
+        # ascending order, and the missing values stay last
+        valid_rows = ascending_permutation[:self.valid_count]
+        sorted_keys = self.ascending_keys[valid_rows]
+        group_starts = np.flatnonzero(np.diff(sorted_keys, prepend=-1) != 0) if len(valid_rows) else valid_rows
+        group_ends = np.append(group_starts[1:], len(valid_rows))
+
+        group_ids = np.repeat(np.arange(len(group_starts)), group_ends - group_starts)
+        positions = (len(valid_rows) - group_ends)[group_ids] + np.arange(len(valid_rows)) - group_starts[group_ids]
+
+        descending_permutation = np.empty_like(ascending_permutation)
+        descending_permutation[positions] = valid_rows
+        descending_permutation[self.valid_count:] = ascending_permutation[self.valid_count:]
+        return descending_permutation
+
+    def permutation(self, ascending=True):
+        return self.ascending_permutation if ascending else self.descending_permutation
+
+    def order(self, rows, ascending=True):
+        keys = self.ascending_keys if ascending else self.descending_keys
+        if keys.dtype == np.uint16 or len(rows) * SUBSET_GATHER_RATIO < len(keys) or np.any(np.diff(rows) < 0):
+            return np.argsort(keys[rows], kind='stable')
+
+        # a large subset in catalog order is ordered by keeping its rows from the full permutation, ties are then
+        # already in subset order
+        permutation = self.permutation(ascending)
+        selected = np.zeros(len(keys), dtype=bool)
+        selected[rows] = True
+        positions = np.empty(len(keys), dtype=np.intp)
+        positions[rows] = np.arange(len(rows))
+        return positions[permutation[selected[permutation]]]
+
+    def between(self, low=None, high=None):
+        sorted_rows = self.ascending_permutation[:self.valid_count]
+        if self.sorted_values is None:
+            self.sorted_values = pd.Index(self.values.to_numpy()[sorted_rows])
+
+        start = 0 if low is None else self.sorted_values.searchsorted(low, side='left')
+        stop = len(sorted_rows) if high is None else self.sorted_values.searchsorted(high, side='right')
+        return sorted_rows[start:stop]
+
+
+class CategoryIndex:
+    def __init__(self, values: pd.Series):
+        self.codes, uniques = pd.factorize(values)
+        self.values = pd.Series(uniques)
+        self.value_set = set(uniques)
+        self.bitmaps = {}
+
+    def __contains__(self, value):
+        return value in self.value_set
+
+    def bitmap(self, pattern: str):
+        if pattern not in self.bitmaps:
+            matches = self.values.str.contains(pattern, case=False, na=False).to_numpy()
+            self.bitmaps[pattern] = np.append(matches, False)[self.codes]
+        return self.bitmaps[pattern]
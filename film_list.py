@@ -1,12 +1,183 @@
+import weakref
+import itertools
+import threading
 from datetime import datetime
+from collections import OrderedDict
 
-from data_scraper import get_film_data
+import numpy as np
+import pandas as pd
+
+from data_scraper import get_film_data, FILM_DATA_PATH
+from film_index import NgramIndex, SortIndex, CategoryIndex, row_dtype
+from metrics import timed
+
+
+SEARCH_HISTORY_SIZE = 32
+NARROW_ROW_LIMIT = 50_000
+QUERY_CACHE_SIZE = 64
+QUERY_CACHE_ROWS = 2_000_000
+COMPACT_STRING_COLUMNS = ('Title', 'Genre', 'Language', 'Type')
+DISPLAY_COLUMNS = ('Original Index', 'Release date', 'Title', 'Genre', 'Runtime', 'Language', 'Type', 'Rating')
+
+
+def format_runtimes(minutes):
+    return (minutes // 60).astype(str) + ' h ' + (minutes % 60).astype(str) + ' min'
+
+
+def format_release_dates(dates):
+    return dates.dt.strftime('%B %d, %Y')
+
+
+def input_rows(film_list, *args, films=None, film_data=None, **kwargs):
+    frame = films if films is not None else film_data
+    return len(film_list.film_data if frame is None else frame)
+
+
+# strings become dictionary encoded categoricals and integers the narrowest type that holds them, Rating stays
+# float64 so ratings such as 7.1 still compare equal to the filter values
+def compact_film_data(film_data: pd.DataFrame):
+    columns = {}
+    for column in film_data.columns:
+        values = film_data[column]
+        if column in COMPACT_STRING_COLUMNS:
+            values = values.astype('category')
+        elif pd.api.types.is_integer_dtype(values):
+            values = pd.to_numeric(values, downcast='integer')
+        columns[column] = values
+    return pd.DataFrame(columns)
+
+
+def array_bytes(value):
+    # only buffers owned by an index are counted, columns it shares with the catalog are reported there
+    if isinstance(value, (np.ndarray, pd.Index)):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(array_bytes(item) for item in value.values())
+    return 0
+
+
+def index_bytes(index):
+    return sum(array_bytes(value) for value in vars(index).values())
+
+
+def build_labels(values, formatter):
+    # catalogs repeat the same few thousand dates and runtimes, so each distinct value is formatted once
+    codes, uniques = pd.factorize(values)
+    labels = np.append(formatter(pd.Series(uniques)).to_numpy(dtype=object), np.nan)[codes]
+    labels.flags.writeable = False
+    return labels
+
+
+class SearchSession:
+    def __init__(self, index: NgramIndex, history_size=SEARCH_HISTORY_SIZE):
+        self.index = index
+        self.history_size = history_size
+        self.history = []
+
+    def search(self, query: str):
+        # drop cached queries the new one no longer contains (e.g. after backspace)
+        while self.history and self.history[-1][0] not in query:
+            self.history.pop()
+
+        if self.history and self.history[-1][0] == query:
+            return self.history[-1][1]
+
+        if self.history and len(self.history[-1][1]) <= NARROW_ROW_LIMIT:
+            rows = self.narrow(query, self.history[-1][1])
+        else:
+            rows = self.index.search(query)
+
+        self.history.append((query, rows))
+        if len(self.history) > self.history_size:
+            self.history.pop(0)
+        return rows
+
+    def narrow(self, query: str, rows):
+        values = self.index.values[self.index.codes[rows]]
+        matches = np.fromiter((query in value for value in values), dtype=bool, count=len(rows))
+        return rows[matches]
+
+    def reset(self):
+        self.history.clear()
+
+
+# query results are kept as the frames they returned, so a hit doesn't touch the catalog at all. Inputs are keyed
+# on a token given to each frame or row array the first time it is seen instead of on their rows, a result keeps its
+# token while it is cached, so chained queries (filter, then search, then sort) hit as long as their inputs do
+class QueryCache:
+    def __init__(self, size=QUERY_CACHE_SIZE, max_rows=QUERY_CACHE_ROWS):
+        self.size = size
+        self.max_rows = max_rows
+        self.frames = OrderedDict()
+        self.rows = 0
+        self.tokens = {}
+        self.generations = itertools.count()
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            frame = self.frames.get(key)
+            if frame is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.frames.move_to_end(key)
+            return frame
+
+    def put(self, key, frame: pd.DataFrame):
+        with self.lock:
+            if key in self.frames:
+                self.rows -= len(self.frames.pop(key))
+            self.frames[key] = frame
+            self.rows += len(frame)
+            while self.frames and (len(self.frames) > self.size or self.rows > self.max_rows):
+                self.rows -= len(self.frames.popitem(last=False)[1])
+
+    def token(self, value):
+        identity = id(value)
+        with self.lock:
+            entry = self.tokens.get(identity)
+            if entry is not None and entry[0]() is value:
+                return entry[1]
+            token = next(self.generations)
+            self.tokens[identity] = (weakref.ref(value, lambda ref: self.__forget(identity, ref)), token)
+            return token
+
+    def __forget(self, identity, ref):
+        # ids are reused once an object is gone, so only the entry of this exact object is dropped
+        with self.lock:
+            entry = self.tokens.get(identity)
+            if entry is not None and entry[0] is ref:
+                del self.tokens[identity]
+
+    def clear(self):
+        with self.lock:
+            self.frames.clear()
+            self.rows = 0
 
 
 class FilmList:
 
-    def __init__(self):
-        self.film_data = get_film_data()
+    def __init__(self, path=FILM_DATA_PATH, query_cache_size=QUERY_CACHE_SIZE, compact=False):
+        self.path = path
+        self.compact = compact
+        self.query_cache = QueryCache(query_cache_size)
+        self.reload()
+
+    @timed('film_list.reload')
+    def reload(self):
+        film_data = get_film_data(self.path)
+        self.film_data = compact_film_data(film_data) if self.compact else film_data
+        self.title_index = NgramIndex(self.film_data['Title'])
+        self.genre_index = NgramIndex(self.film_data['Genre'])
+        self.sort_indices = {column: SortIndex(self.film_data[column]) for column in self.film_data.columns}
+        self.category_indices = {column: CategoryIndex(self.film_data[column])
+                                 for column in ('Genre', 'Language', 'Type')}
+        self.display_columns = self.build_display_columns()
+        self.row_lookup = self.build_row_lookup()
+        self.query_cache.clear()
 
     def __len__(self):
         return len(self.film_data)
@@ -14,31 +185,125 @@ class FilmList:
     def __iter__(self):
         return iter(self.film_data)
 
+    def build_display_columns(self):
+        display_columns = {}
+        for column in DISPLAY_COLUMNS:
+            match column:
+                case 'Release date':
+                    values = build_labels(self.film_data[column], format_release_dates)
+                case 'Runtime':
+                    values = build_labels(self.film_data[column], format_runtimes)
+                case _:
+                    values = self.film_data[column].to_numpy(dtype=object, copy=True)
+                    values.flags.writeable = False
+            display_columns[column] = values
+        return display_columns
+
+    # dense map from Original Index to row position, ids that are not in the catalog map to -1
+    def build_row_lookup(self):
+        film_indices = self.film_data['Original Index'].to_numpy()
+        size = int(film_indices.max()) + 1 if len(film_indices) else 0
+        row_lookup = np.full(size, -1, dtype=row_dtype(len(film_indices)))
+        row_lookup[film_indices] = np.arange(len(film_indices))
+        return row_lookup
+
+    def memory_report(self):
+        columns = self.film_data.memory_usage(index=True, deep=True)
+        indices = {'title_index': index_bytes(self.title_index),
+                   'genre_index': index_bytes(self.genre_index),
+                   'sort_indices': sum(index_bytes(index) for index in self.sort_indices.values()),
+                   'category_indices': sum(index_bytes(index) for index in self.category_indices.values()),
+                   'row_lookup': self.row_lookup.nbytes,
+                   # display arrays hold references to the catalog strings and to one label per distinct value
+                   'display_columns': sum(values.nbytes for values in self.display_columns.values()),
+                   # cached frames share their strings with the catalog, only their own buffers are counted
+                   'query_cache': sum(int(frame.memory_usage(index=True).sum())
+                                      for frame in list(self.query_cache.frames.values()))}
+
+        return {'rows': len(self.film_data),
+                'compact': self.compact,
+                'columns': {column: int(size) for column, size in columns.items()},
+                'catalog_bytes': int(columns.sum()),
+                'indices': indices,
+                'total_bytes': int(columns.sum()) + sum(indices.values())}
+
     def get_formatted_film_data(self, film_data=None):
         if film_data is None:
             film_data = self.film_data
 
-        film_data['Release date'] = film_data['Release date'].apply(lambda date: date.strftime('%B %d, %Y'))
-        film_data['Runtime'] = film_data['Runtime'].apply(
-            lambda td: f'{td.seconds // 3600} h {td.seconds // 60 % 60} min')
+        rows = film_data.index.to_numpy()
+        formatted = film_data.copy()
+        formatted['Release date'] = self.display_columns['Release date'][rows]
+        formatted['Runtime'] = self.display_columns['Runtime'][rows]
 
-        return film_data
+        return formatted
 
+    def get_row_values(self, rows):
+        return list(zip(*(values[rows] for values in self.display_columns.values())))
+
+    def frame_key(self, frame):
+        if frame is None or frame is self.film_data:
+            return None
+        return self.query_cache.token(frame)
+
+    def cached_query(self, key: tuple, frame, query):
+        key = (*key, self.frame_key(frame))
+        result = self.query_cache.get(key)
+        if result is not None:
+            return result
+
+        result = query()
+        self.query_cache.put(key, result)
+        return result
+
+    @timed('search_film', rows_in=input_rows, rows_out=len)
     def search_film(self, film_name: str, films=None):
-        if films is None:
-            films = self.film_data
-        search_results = films[films['Title'].str.contains(film_name)]
-        return search_results
+        return self.cached_query(('search_film', film_name), films,
+                                 lambda: self.__select_rows(self.title_index.search(film_name), films))
 
+    @timed('search_genre', rows_in=input_rows, rows_out=len)
     def search_genre(self, film_genre: str, films=None):
+        return self.cached_query(('search_genre', film_genre), films,
+                                 lambda: self.__select_rows(self.genre_index.search(film_genre), films))
+
+    def search_session(self, column: str):
+        match column:
+            case 'Title':
+                return SearchSession(self.title_index)
+            case 'Genre':
+                return SearchSession(self.genre_index)
+        raise ValueError(f'The column {column} is not searchable')
+
+    def select_rows(self, rows, films=None):
         if films is None:
-            films = self.film_data
-        search_results = films[films['Genre'].str.contains(film_genre)]
-        return search_results
+            return self.film_data.iloc[rows]
+        rows = np.asarray(rows)
+        return self.cached_query(('select_rows', self.query_cache.token(rows)), films,
+                                 lambda: self.__select_rows(rows, films))
 
+    def __select_rows(self, rows, films=None):
+        if films is None:
+            return self.film_data.iloc[rows]
+        return films[np.isin(films.index.to_numpy(), rows)]
+
+    @timed('get_by_films_index', rows_in=lambda film_list, film_indices: len(film_indices), rows_out=len)
     def get_by_films_index(self, film_indices: list):
-        return self.film_data[self.film_data['Original Index'].isin(film_indices)]
+        rows, missing = self.resolve_films_index(film_indices)
+        if missing:
+            print(f'{len(missing)} films are not in the catalog: {", ".join(map(str, missing))}')
+        return self.film_data.iloc[rows]
+
+    # gathers through the row lookup, so a list costs the same on any catalog size and keeps its own order
+    def resolve_films_index(self, film_indices: list):
+        film_indices = np.asarray(film_indices, dtype=np.int64)
+        rows = np.full(len(film_indices), -1, dtype=np.intp)
+        known = (film_indices >= 0) & (film_indices < len(self.row_lookup))
+        rows[known] = self.row_lookup[film_indices[known]]
+
+        found = rows >= 0
+        return rows[found], film_indices[~found].tolist()
 
+    @timed('sort_by', rows_in=input_rows, rows_out=len)
     def sort_by(self, column: str, ascending=True, film_data=None):
         if film_data is None:
             film_data = self.film_data
@@ -47,9 +312,21 @@ class FilmList:
         if column not in valid_columns:
             raise ValueError(f'The column {column} does not exist')
 
-        films = film_data.sort_values(by=column, ascending=ascending, na_position='last', kind='stable')
-        return films
+        return self.cached_query(('sort_by', column, bool(ascending)), film_data,
+                                 lambda: self.__sort_by(column, ascending, film_data))
+
+    def __sort_by(self, column: str, ascending: bool, film_data):
+        sort_index = self.sort_indices.get(column)
+        if sort_index is None:
+            return film_data.sort_values(by=column, ascending=ascending, na_position='last', kind='stable')
+
+        if film_data is self.film_data:
+            return film_data.take(sort_index.permutation(ascending))
+
+        # film_data is a subset of the catalog, so its index labels are catalog row positions
+        return film_data.take(sort_index.order(film_data.index.to_numpy(), ascending))
 
+    @timed('filter_by', rows_in=input_rows, rows_out=len)
     def filter_by(self,
                   date_from=datetime(2014, 1, 1),
                   date_to=None,
@@ -61,43 +338,85 @@ class FilmList:
                   rating_from=0.0,
                   rating_to=10.0,
                   films=None):
+        filters = dict(date_from=date_from, date_to=date_to, genre=genre,
+                       runtime_from=runtime_from, runtime_to=runtime_to,
+                       language=language, film_type=film_type,
+                       rating_from=rating_from, rating_to=rating_to)
+
+        # empty and missing filters select the same films, so they share a key (not for genre, an empty genre is
+        # rejected)
+        key = ('filter_by', date_from or None, date_to or None, genre, runtime_from or None, runtime_to or None,
+               language or None, film_type or None, rating_from, rating_to)
+        return self.cached_query(key, films, lambda: self.__filter_by(films, **filters))
+
+    def __filter_by(self, films, **filters):
+        predicates = self.filter_predicates(**filters)
+        if not predicates:
+            return self.film_data if films is None else films
+
+        selected = self.combine_predicates(predicates)
         if films is None:
-            films = self.film_data
+            return self.film_data[selected]
+        return films[selected[films.index.to_numpy()]]
+
+    def filter_rows(self, **filters):
+        return np.flatnonzero(self.filter_mask(**filters))
+
+    def filter_mask(self, **filters):
+        return self.combine_predicates(self.filter_predicates(**filters))
+
+    def filter_predicates(self,
+                          date_from=datetime(2014, 1, 1),
+                          date_to=None,
+                          genre=None,
+                          runtime_from=None,
+                          runtime_to=None,
+                          language=None,
+                          film_type=None,
+                          rating_from=0.0,
+                          rating_to=10.0):
+        predicates = []
 
         if date_from and date_to and date_from > date_to:
             raise ValueError('\'Date from\' cant be greater than \'Date to\'')
-        if date_from:
-            films = films[films['Release date'] >= date_from]
-        if date_to:
-            films = films[films['Release date'] <= date_to]
+        if date_from or date_to:
+            predicates.append(self.sort_indices['Release date'].between(date_from or None, date_to or None))
 
-        if genre in self.film_data['Genre'].unique():
-            films = films[films['Genre'].str.contains(genre, case=False, na=False)]
+        if genre in self.category_indices['Genre']:
+            predicates.append(self.category_indices['Genre'].bitmap(genre))
         elif genre is not None:
             raise ValueError(f'Genre {genre} does not exist in film list')
 
         if runtime_from and runtime_to and runtime_from > runtime_to:
             raise ValueError('\'Runtime from\' cant be greater than \'Runtime to\'')
-        if runtime_from:
-            films = films[films['Runtime'] >= runtime_from]
-        if runtime_to:
-            films = films[films['Runtime'] <= runtime_to]
+        if runtime_from or runtime_to:
+            predicates.append(self.sort_indices['Runtime'].between(runtime_from or None, runtime_to or None))
 
-        if language in self.film_data['Language'].unique():
-            films = films[films['Language'].str.contains(language, case=False, na=False)]
+        if language in self.category_indices['Language']:
+            predicates.append(self.category_indices['Language'].bitmap(language))
         elif language is not None and language != '':
             raise ValueError(f'Language {language} does not exist in film list')
 
-        if film_type in self.film_data['Type'].unique():
-            films = films[films['Type'].str.contains(film_type, case=False, na=False)]
+        if film_type in self.category_indices['Type']:
+            predicates.append(self.category_indices['Type'].bitmap(film_type))
         elif film_type is not None and film_type != '':
             raise ValueError(f'Film type {film_type} does not exist in film list')
 
         if rating_from > rating_to:
             raise ValueError('\'Rating from\' cant be greater than \'Rating to\'')
-        if rating_from > 0.0:
-            films = films[films['Rating'] >= rating_from]
-        if rating_to < 10.0:
-            films = films[films['Rating'] <= rating_to]
+        if rating_from > 0.0 or rating_to < 10.0:
+            predicates.append(self.sort_indices['Rating'].between(rating_from if rating_from > 0.0 else None,
+                                                                  rating_to if rating_to < 10.0 else None))
+        return predicates
+
+    def combine_predicates(self, predicates: list):
+        selected = np.ones(len(self.film_data), dtype=bool)
+        for predicate in predicates:
+            if predicate.dtype == bool:
+                selected &= predicate
+            else:
+                matches = np.zeros(len(self.film_data), dtype=bool)
+                matches[predicate] = True
+                selected &= matches
 
-        return films
+        return selected
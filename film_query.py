@@ -0,0 +1,118 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from data_scraper import runtime_minutes
+from film_list import FilmList, DISPLAY_COLUMNS
+from user_handler import UserHandler
+
+DEFAULT_LIMIT = 50
+FILTER_FIELDS = ('date_from', 'date_to', 'runtime_from', 'runtime_to', 'language', 'film_type',
+                 'rating_from', 'rating_to')
+FILM_ACTIONS = ('add_to_watch', 'remove_to_watch', 'add_watched', 'remove_watched', 'move_to_watched',
+                'move_to_towatch')
+LIST_POSITIONS = {'to_watch': 0, 'watched': 1}
+
+
+def parse_filters(query: dict):
+    # same defaults as the GUI filters: no date range and the full rating range
+    filters = {'date_from': None}
+    for field in FILTER_FIELDS:
+        value = query.get(field)
+        if value is None or value == '':
+            continue
+
+        match field:
+            case 'date_from' | 'date_to':
+                filters[field] = datetime.strptime(value, '%Y-%m-%d')
+            case 'runtime_from' | 'runtime_to':
+                value = str(value)
+                filters[field] = int(value) if value.isdigit() else runtime_minutes(value)
+            case 'rating_from' | 'rating_to':
+                filters[field] = float(value)
+            case _:
+                filters[field] = value
+    return filters
+
+
+def film_records(film_data):
+    columns = []
+    for column in DISPLAY_COLUMNS:
+        values = film_data[column].to_numpy()
+        missing = pd.isna(values)
+        if column == 'Release date':
+            values = np.datetime_as_string(values, unit='D')
+        columns.append(np.where(missing, None, values.astype(object)).tolist())
+    return [dict(zip(DISPLAY_COLUMNS, row)) for row in zip(*columns)]
+
+
+class FilmQuery:
+    def __init__(self, film_list: FilmList, user_handler: UserHandler = None):
+        self.film_list = film_list
+        self.user_handler = user_handler
+
+    def run(self, query: dict):
+        action = query.get('action', 'films')
+        match action:
+            case 'films':
+                return self.films(query)
+            case 'reload':
+                self.film_list.reload()
+                return {'films': len(self.film_list)}
+            case 'lists':
+                to_watch, watched = self.users().get_user_lists(query['user'])
+                return {'to_watch': to_watch, 'watched': watched}
+            case 'add_user':
+                self.users().add_user(query['user'], query['password'])
+                return {'user': query['user']}
+            case 'remove_user':
+                self.users().remove_user(query['user'])
+                return {'user': query['user']}
+            case _ if action in FILM_ACTIONS:
+                getattr(self.users(), action)(query['user'], int(query['index']))
+                return {'user': query['user'], 'index': int(query['index'])}
+        raise ValueError(f'Unknown action {action}')
+
+    def users(self):
+        if self.user_handler is None:
+            raise ValueError('User lists are not available')
+        return self.user_handler
+
+    # the same steps the GUI runs for a tab: pick the list, filter it, search it and sort it
+    def select(self, query: dict):
+        list_name = query.get('list')
+        missing = []
+        if list_name is None:
+            films = self.film_list.film_data
+        elif list_name in LIST_POSITIONS:
+            user_lists = self.users().get_user_lists(query['user'])
+            rows, missing = self.film_list.resolve_films_index(user_lists[LIST_POSITIONS[list_name]])
+            films = self.film_list.select_rows(rows)
+        else:
+            raise ValueError(f'List {list_name} does not exist')
+
+        films = self.film_list.filter_by(films=films, **parse_filters(query))
+
+        if query.get('title'):
+            films = self.film_list.search_film(query['title'], films=films)
+        if query.get('genre'):
+            films = self.film_list.search_genre(query['genre'], films=films)
+
+        if query.get('sort'):
+            films = self.film_list.sort_by(query['sort'], ascending=query.get('ascending', True), film_data=films)
+        return films, missing
+
+    def films(self, query: dict):
+        films, missing = self.select(query)
+
+        offset = int(query.get('offset', 0))
+        limit = int(query.get('limit', DEFAULT_LIMIT))
+        if offset < 0 or limit < 0:
+            raise ValueError('Offset and limit can\'t be negative')
+
+        response = {'total': len(films), 'offset': offset, 'rows': film_records(films.iloc[offset:offset + limit])}
+        # ids kept in a user list whose films are no longer in the catalog
+        if missing:
+            response['missing'] = missing
+        return response
@@ -0,0 +1,285 @@
+import re
+import json
+import asyncio
+import argparse
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import urlsplit, parse_qsl, unquote
+
+import metrics
+from data_scraper import FILM_DATA_PATH
+from film_list import FilmList
+from film_query import FilmQuery
+from user_handler import UserHandler
+from user_storage import open_user_storage, USERS_JSON_PATH, USERS_DB_PATH
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8080
+CACHE_SIZE = 1024
+MAX_WORKERS = 4
+MAX_BODY_SIZE = 1 << 20
+FALSE_VALUES = ('0', 'false', 'no')
+NOT_FOUND_PATTERN = re.compile(r'^User .* does not exist$')
+
+LIST_ADD_ACTIONS = {'to_watch': 'add_to_watch', 'watched': 'add_watched'}
+LIST_REMOVE_ACTIONS = {'to_watch': 'remove_to_watch', 'watched': 'remove_watched'}
+LIST_MOVE_ACTIONS = {'to_watch': 'move_to_towatch', 'watched': 'move_to_watched'}
+
+
+class HttpError(Exception):
+    def __init__(self, status: HTTPStatus, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class ResponseCache:
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self.responses = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        response = self.responses.get(key)
+        if response is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.responses.move_to_end(key)
+        return response
+
+    def put(self, key, response: bytes):
+        self.responses[key] = response
+        self.responses.move_to_end(key)
+        if len(self.responses) > self.size:
+            self.responses.popitem(last=False)
+
+    def clear(self):
+        self.responses.clear()
+
+
+def normalize_params(query_string: str):
+    params = {name: value.strip() for name, value in parse_qsl(query_string) if value.strip() != ''}
+    if 'ascending' in params:
+        params['ascending'] = params['ascending'].lower() not in FALSE_VALUES
+    return params
+
+
+class FilmServer:
+    # routes are matched in order: (method, path pattern, handler name)
+    ROUTES = [
+        ('GET', r'/health', 'health'),
+        ('GET', r'/metrics', 'metrics'),
+        ('GET', r'/films', 'films'),
+        ('POST', r'/reload', 'reload'),
+        ('POST', r'/users', 'add_user'),
+        ('DELETE', r'/users/(?P<user>[^/]+)', 'remove_user'),
+        ('GET', r'/users/(?P<user>[^/]+)/lists', 'lists'),
+        ('GET', r'/users/(?P<user>[^/]+)/lists/(?P<list_name>to_watch|watched)', 'list_films'),
+        ('POST', r'/users/(?P<user>[^/]+)/lists/(?P<list_name>to_watch|watched)', 'add_to_list'),
+        ('POST', r'/users/(?P<user>[^/]+)/lists/(?P<list_name>to_watch|watched)/move', 'move_to_list'),
+        ('DELETE', r'/users/(?P<user>[^/]+)/lists/(?P<list_name>to_watch|watched)/(?P<index>\d+)',
+         'remove_from_list'),
+    ]
+
+    def __init__(self, catalog_path=FILM_DATA_PATH, user_handler: UserHandler = None, cache_size=CACHE_SIZE,
+                 max_workers=MAX_WORKERS, compact=False):
+        self.catalog_path = catalog_path
+        self.compact = compact
+        self.user_handler = user_handler
+        self.film_query = FilmQuery(FilmList(catalog_path, compact=compact), user_handler)
+        self.cache = ResponseCache(cache_size)
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix='film-server')
+        self.routes = [(method, re.compile(pattern + '$'), getattr(self, name))
+                       for method, pattern, name in self.ROUTES]
+
+    async def run_query(self, query: dict, film_query=None):
+        film_query = film_query or self.film_query
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, film_query.run, query)
+
+    async def health(self, params, body):
+        return {'films': len(self.film_query.film_list), 'cache': {'entries': len(self.cache.responses),
+                                                                   'hits': self.cache.hits,
+                                                                   'misses': self.cache.misses}}
+
+    async def metrics(self, params, body):
+        return metrics.to_prometheus()
+
+    # catalog queries only depend on their parameters, so their encoded responses are cached until a reload,
+    # user lists change between reloads and are always queried fresh
+    async def films(self, params, body):
+        if 'list' in params or 'user' in params:
+            return encode(await self.run_query({**params, 'action': 'films'}))
+
+        key = json.dumps(params, sort_keys=True)
+        response = self.cache.get(key)
+        if response is None:
+            film_query = self.film_query
+            response = encode(await self.run_query({**params, 'action': 'films'}, film_query))
+            if film_query is self.film_query:
+                self.cache.put(key, response)
+        return response
+
+    # a fresh FilmList is built off the event loop and swapped in whole, queries already running keep the old one
+    async def reload(self, params, body):
+        loop = asyncio.get_running_loop()
+        film_list = await loop.run_in_executor(self.executor, lambda: FilmList(self.catalog_path, compact=self.compact))
+        self.film_query = FilmQuery(film_list, self.user_handler)
+        self.cache.clear()
+        return {'films': len(film_list)}
+
+    async def add_user(self, params, body):
+        return await self.run_query({'action': 'add_user', 'user': body.get('user'),
+                                     'password': body.get('password')})
+
+    async def remove_user(self, params, body, user):
+        return await self.run_query({'action': 'remove_user', 'user': user})
+
+    async def lists(self, params, body, user):
+        return await self.run_query({'action': 'lists', 'user': user})
+
+    async def list_films(self, params, body, user, list_name):
+        return await self.run_query({**params, 'action': 'films', 'user': user, 'list': list_name})
+
+    async def add_to_list(self, params, body, user, list_name):
+        return await self.run_query({'action': LIST_ADD_ACTIONS[list_name], 'user': user,
+                                     'index': body.get('index')})
+
+    async def move_to_list(self, params, body, user, list_name):
+        return await self.run_query({'action': LIST_MOVE_ACTIONS[list_name], 'user': user,
+                                     'index': body.get('index')})
+
+    async def remove_from_list(self, params, body, user, list_name, index):
+        return await self.run_query({'action': LIST_REMOVE_ACTIONS[list_name], 'user': user, 'index': int(index)})
+
+    async def dispatch(self, method: str, target: str, body: bytes):
+        url = urlsplit(target)
+        path = url.path.rstrip('/') or '/'
+
+        allowed = False
+        for route_method, pattern, handler in self.routes:
+            match = pattern.match(path)
+            if match is None:
+                continue
+            if route_method != method:
+                allowed = True
+                continue
+
+            try:
+                payload = json.loads(body) if body else {}
+            except ValueError:
+                raise HttpError(HTTPStatus.BAD_REQUEST, 'Request body is not valid JSON')
+            if not isinstance(payload, dict):
+                raise HttpError(HTTPStatus.BAD_REQUEST, 'Request body must be a JSON object')
+
+            arguments = {name: unquote(value) for name, value in match.groupdict().items()}
+            try:
+                return await handler(normalize_params(url.query), payload, **arguments)
+            except (ValueError, TypeError) as error:
+                if NOT_FOUND_PATTERN.match(str(error)):
+                    raise HttpError(HTTPStatus.NOT_FOUND, str(error))
+                raise HttpError(HTTPStatus.BAD_REQUEST, str(error))
+            except KeyError as error:
+                raise HttpError(HTTPStatus.BAD_REQUEST, f'Missing field {error}')
+
+        if allowed:
+            raise HttpError(HTTPStatus.METHOD_NOT_ALLOWED, f'Method {method} is not allowed on {path}')
+        raise HttpError(HTTPStatus.NOT_FOUND, f'No route for {path}')
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    await self.respond(writer, HTTPStatus.BAD_REQUEST, {'error': 'Malformed request line'}, False)
+                    break
+
+                headers = {}
+                while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                keep_alive = (version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                              or headers.get('connection', '').lower() == 'keep-alive')
+
+                try:
+                    length = int(headers.get('content-length') or 0)
+                except ValueError:
+                    length = -1
+                # without a valid length the end of the body is unknown, so the connection can't be reused
+                if length < 0:
+                    await self.respond(writer, HTTPStatus.BAD_REQUEST, {'error': 'Invalid Content-Length'}, False)
+                    break
+                if length > MAX_BODY_SIZE:
+                    await self.respond(writer, HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                                       {'error': 'Request body is too large'}, False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                try:
+                    status, response = HTTPStatus.OK, await self.dispatch(method.upper(), target, body)
+                except HttpError as error:
+                    status, response = error.status, {'error': str(error)}
+                except Exception as error:
+                    traceback.print_exception(error)
+                    status, response = HTTPStatus.INTERNAL_SERVER_ERROR, {'error': 'Internal server error'}
+                await self.respond(writer, status, response, keep_alive)
+
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def respond(writer: asyncio.StreamWriter, status: HTTPStatus, response, keep_alive: bool):
+        content_type = 'text/plain; version=0.0.4' if isinstance(response, str) else 'application/json'
+        if isinstance(response, str):
+            body = response.encode('utf-8')
+        else:
+            body = response if isinstance(response, bytes) else encode(response)
+        writer.write(f'HTTP/1.1 {status.value} {status.phrase}\r\n'
+                     f'Content-Type: {content_type}\r\n'
+                     f'Content-Length: {len(body)}\r\n'
+                     f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'.encode('latin-1') + body)
+        await writer.drain()
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print(f'Serving films on http://{host}:{server.sockets[0].getsockname()[1]}')
+        async with server:
+            await server.serve_forever()
+
+
+def encode(response):
+    return json.dumps(response).encode('utf-8')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve Film Explorer queries over HTTP')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--catalog', default=FILM_DATA_PATH)
+    parser.add_argument('--users-json', default=USERS_JSON_PATH)
+    parser.add_argument('--users-db', default=USERS_DB_PATH)
+    parser.add_argument('--cache-size', type=int, default=CACHE_SIZE)
+    parser.add_argument('--compact', action='store_true', help='keep the catalog in the compact representation')
+    args = parser.parse_args()
+
+    user_handler = UserHandler(storage=open_user_storage(args.users_json, args.users_db))
+    film_server = FilmServer(args.catalog, user_handler, cache_size=args.cache_size, compact=args.compact)
+    try:
+        asyncio.run(film_server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        user_handler.close()
@@ -0,0 +1,110 @@
+import os
+import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from metrics import timed
+
+HTTP_CACHE_DIR = 'resources/data_scraper/http_cache'
+MAX_WORKERS = 4
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 0.5
+REQUEST_TIMEOUT = 30
+USER_AGENT = 'FilmExplorer/1.0 (Netflix film catalog scraper)'
+
+
+class HttpCache:
+    def __init__(self, cache_dir=HTTP_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.objects_dir = os.path.join(cache_dir, 'objects')
+        self.index_path = os.path.join(cache_dir, 'index.json')
+        self.lock = threading.Lock()
+
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as file:
+                self.index = json.load(file)
+
+    def get(self, url: str):
+        with self.lock:
+            entry = self.index.get(url)
+        if entry is None or not os.path.exists(self.object_path(entry['sha256'])):
+            return None
+        return entry
+
+    def object_path(self, digest: str):
+        return os.path.join(self.objects_dir, digest)
+
+    def read(self, entry: dict):
+        with open(self.object_path(entry['sha256']), 'rb') as file:
+            return file.read()
+
+    # bodies are stored under their SHA-256, so pages with the same content share one object and an object is
+    # never rewritten in place
+    def store(self, url: str, content: bytes, headers):
+        digest = hashlib.sha256(content).hexdigest()
+        path = self.object_path(digest)
+        if not os.path.exists(path):
+            tmp_path = f'{path}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'wb') as file:
+                file.write(content)
+            os.replace(tmp_path, path)
+
+        entry = {'sha256': digest, 'etag': headers.get('ETag'), 'last_modified': headers.get('Last-Modified')}
+        with self.lock:
+            self.index[url] = entry
+            tmp_path = self.index_path + '.tmp'
+            with open(tmp_path, 'w') as file:
+                json.dump(self.index, file, indent=4)
+            os.replace(tmp_path, self.index_path)
+        return entry
+
+
+def create_session(pool_size=MAX_WORKERS, retries=MAX_RETRIES):
+    retry = Retry(total=retries, backoff_factor=BACKOFF_FACTOR, status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=('GET', 'HEAD'))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+    session = requests.Session()
+    session.headers['User-Agent'] = USER_AGENT
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def fetch_page(session: requests.Session, cache: HttpCache, url: str, timeout=REQUEST_TIMEOUT):
+    entry = cache.get(url)
+    headers = {}
+    if entry is not None:
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+
+    try:
+        response = session.get(url, headers=headers, timeout=timeout)
+        if response.status_code == 304 and entry is not None:
+            return cache.read(entry)
+        response.raise_for_status()
+    except requests.RequestException as error:
+        if entry is None:
+            raise
+        print(f'Could not revalidate {url} ({error}), using the cached copy')
+        return cache.read(entry)
+
+    cache.store(url, response.content, response.headers)
+    return response.content
+
+
+@timed('fetch_pages', rows_in=lambda urls, *args, **kwargs: len(urls), rows_out=len)
+def fetch_pages(urls: list, cache_dir=HTTP_CACHE_DIR, max_workers=MAX_WORKERS, retries=MAX_RETRIES,
+                timeout=REQUEST_TIMEOUT):
+    cache = HttpCache(cache_dir)
+    with create_session(max_workers, retries) as session, ThreadPoolExecutor(max_workers) as executor:
+        return list(executor.map(lambda url: fetch_page(session, cache, url, timeout), urls))
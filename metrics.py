@@ -0,0 +1,160 @@
+import os
+import json
+import time
+import atexit
+import bisect
+import functools
+import threading
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+DEFAULT_SLOW_MS = 50.0
+PROMETHEUS_PREFIX = 'film_explorer'
+
+enabled = False
+trace_path = None
+slow_seconds = DEFAULT_SLOW_MS / 1000
+lock = threading.Lock()
+stats = {}
+
+
+def enable(trace=None, slow_ms=DEFAULT_SLOW_MS):
+    global enabled, trace_path, slow_seconds
+    trace_path = trace
+    slow_seconds = slow_ms / 1000
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def reset():
+    with lock:
+        stats.clear()
+
+
+def new_stat():
+    return {'calls': 0, 'errors': 0, 'seconds': 0.0, 'buckets': [0] * (len(LATENCY_BUCKETS) + 1),
+            'rows_in': 0, 'rows_out': 0, 'bytes_written': 0}
+
+
+def record(name: str, seconds: float, rows_in=None, rows_out=None, bytes_written=None, failed=False, details=None):
+    with lock:
+        stat = stats.get(name)
+        if stat is None:
+            stat = stats[name] = new_stat()
+        stat['calls'] += 1
+        stat['errors'] += failed
+        stat['seconds'] += seconds
+        stat['buckets'][bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        stat['rows_in'] += rows_in or 0
+        stat['rows_out'] += rows_out or 0
+        stat['bytes_written'] += bytes_written or 0
+
+    if trace_path is not None and seconds >= slow_seconds:
+        entry = {'time': time.time(), 'name': name, 'ms': round(seconds * 1000, 3), 'rows_in': rows_in,
+                 'rows_out': rows_out, 'bytes_written': bytes_written, 'failed': failed, **(details or {})}
+        with lock, open(trace_path, 'a') as file:
+            file.write(json.dumps(entry, default=str) + '\n')
+
+
+def trace_details(seconds: float, args, kwargs):
+    if trace_path is None or seconds < slow_seconds:
+        return None
+
+    # arguments are kept short so a trace line stays readable, frames only contribute their length
+    details = {f'arg{position}': summarize(value) for position, value in enumerate(args)}
+    details.update((name, summarize(value)) for name, value in kwargs.items())
+    return {'args': details}
+
+
+def summarize(value):
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value if not isinstance(value, str) else value[:80]
+    if hasattr(value, '__len__') and not isinstance(value, dict):
+        return f'<{type(value).__name__} len={len(value)}>'
+    return repr(value)[:80]
+
+
+# when metrics are disabled the wrapper only checks a module flag before calling through
+def timed(name: str, rows_in=None, rows_out=None, bytes_written=None):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+
+            started = time.perf_counter()
+            try:
+                result = function(*args, **kwargs)
+            except BaseException:
+                seconds = time.perf_counter() - started
+                record(name, seconds, failed=True, details=trace_details(seconds, args, kwargs))
+                raise
+            seconds = time.perf_counter() - started
+
+            record(name, seconds,
+                   rows_in=rows_in(*args, **kwargs) if rows_in else None,
+                   rows_out=rows_out(result) if rows_out else None,
+                   bytes_written=bytes_written(result) if bytes_written else None,
+                   details=trace_details(seconds, args, kwargs))
+            return result
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def stage(name: str):
+    if not enabled:
+        yield
+        return
+
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        record(name, time.perf_counter() - started, failed=True)
+        raise
+    record(name, time.perf_counter() - started)
+
+
+def snapshot():
+    with lock:
+        return {'buckets': list(LATENCY_BUCKETS),
+                'metrics': {name: {**stat, 'buckets': list(stat['buckets'])} for name, stat in stats.items()}}
+
+
+def to_prometheus():
+    metrics = snapshot()['metrics']
+    lines = [f'# TYPE {PROMETHEUS_PREFIX}_call_duration_seconds histogram']
+    for name, stat in sorted(metrics.items()):
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), stat['buckets']):
+            cumulative += count
+            lines.append(f'{PROMETHEUS_PREFIX}_call_duration_seconds_bucket{{name="{name}",le="{bound}"}} {cumulative}')
+        lines.append(f'{PROMETHEUS_PREFIX}_call_duration_seconds_sum{{name="{name}"}} {stat["seconds"]}')
+        lines.append(f'{PROMETHEUS_PREFIX}_call_duration_seconds_count{{name="{name}"}} {stat["calls"]}')
+
+    for counter in ('errors', 'rows_in', 'rows_out', 'bytes_written'):
+        lines.append(f'# TYPE {PROMETHEUS_PREFIX}_{counter}_total counter')
+        for name, stat in sorted(metrics.items()):
+            lines.append(f'{PROMETHEUS_PREFIX}_{counter}_total{{name="{name}"}} {stat[counter]}')
+    return '\n'.join(lines) + '\n'
+
+
+def export(path: str):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as file:
+        if path.endswith('.prom') or path.endswith('.txt'):
+            file.write(to_prometheus())
+        else:
+            json.dump(snapshot(), file, indent=4)
+    os.replace(tmp_path, path)
+
+
+if os.environ.get('FILM_EXPLORER_METRICS'):
+    enable(os.environ.get('FILM_EXPLORER_TRACE'), float(os.environ.get('FILM_EXPLORER_SLOW_MS', DEFAULT_SLOW_MS)))
+    if os.environ['FILM_EXPLORER_METRICS'] not in ('1', 'true', 'yes'):
+        atexit.register(export, os.environ['FILM_EXPLORER_METRICS'])
@@ -0,0 +1,91 @@
+import queue
+import threading
+import traceback
+
+POLL_INTERVAL_MS = 15
+
+
+class QueryExecutor:
+    def __init__(self, root, poll_interval_ms=POLL_INTERVAL_MS):
+        self.root = root
+        self.poll_interval_ms = poll_interval_ms
+
+        self.generations = {}
+        self.pending_dispatches = {}
+        self.outstanding = 0
+        self.polling = False
+
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        self.worker = threading.Thread(target=self.__work, name='query-executor', daemon=True)
+        self.worker.start()
+
+    def submit(self, query, on_done=None, on_error=None, key=None, delay_ms=0):
+        generation = None
+        if key is not None:
+            generation = self.generations.get(key, 0) + 1
+            self.generations[key] = generation
+            if key in self.pending_dispatches:
+                self.root.after_cancel(self.pending_dispatches.pop(key))
+
+        job = (key, generation, query, on_done, on_error)
+        if delay_ms:
+            self.pending_dispatches[key] = self.root.after(delay_ms, lambda: self.__dispatch(job))
+        else:
+            self.__dispatch(job)
+
+    def is_current(self, key, generation):
+        return key is None or self.generations.get(key) == generation
+
+    def __dispatch(self, job):
+        key = job[0]
+        self.pending_dispatches.pop(key, None)
+        self.outstanding += 1
+        self.jobs.put(job)
+
+        if not self.polling:
+            self.polling = True
+            self.root.after(self.poll_interval_ms, self.__poll)
+
+    def __work(self):
+        while True:
+            key, generation, query, on_done, on_error = self.jobs.get()
+
+            # a newer query with the same key was submitted while this one was queued
+            if not self.is_current(key, generation):
+                self.results.put((key, generation, None, None, None, None))
+                continue
+
+            try:
+                self.results.put((key, generation, query(), None, on_done, on_error))
+            except Exception as error:
+                self.results.put((key, generation, None, error, on_done, on_error))
+
+    def __poll(self):
+        try:
+            while True:
+                try:
+                    key, generation, result, error, on_done, on_error = self.results.get_nowait()
+                except queue.Empty:
+                    break
+
+                self.outstanding -= 1
+                if not self.is_current(key, generation):
+                    continue
+
+                # a failing callback is only logged, so it can't stop the results of later queries
+                try:
+                    if error is not None:
+                        if on_error is None:
+                            traceback.print_exception(error)
+                        else:
+                            on_error(error)
+                    elif on_done is not None:
+                        on_done(result)
+                except Exception as callback_error:
+                    traceback.print_exception(callback_error)
+        finally:
+            if self.outstanding:
+                self.root.after(self.poll_interval_ms, self.__poll)
+            else:
+                self.polling = False
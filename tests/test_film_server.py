@@ -0,0 +1,31 @@
+import json
+import asyncio
+
+from film_server import FilmServer
+from user_handler import UserHandler
+
+CATALOG = '''Release date,Title,Genre,Runtime,Language,Type,Rating,Original Index
+2015-03-06,My Own Man,Documentary,0 days 01:21:00,English,Documentaries,,0
+2015-05-22,The Other One,Documentary,0 days 01:23:00,English,Documentaries,7.1,1
+2016-01-08,The Forest,Horror,0 days 01:33:00,English,Films,4.8,2
+'''
+
+
+def request(server: FilmServer, method: str, target: str, body=None):
+    response = asyncio.run(server.dispatch(method, target, json.dumps(body).encode() if body else b''))
+    return json.loads(response) if isinstance(response, bytes) else response
+
+
+def test_list_films_follow_list_changes(tmp_path):
+    catalog_path = tmp_path / 'films.csv'
+    catalog_path.write_text(CATALOG)
+    server = FilmServer(str(catalog_path), UserHandler(str(tmp_path / 'users.json')))
+
+    request(server, 'POST', '/users', {'user': 'bobby', 'password': 'secret'})
+    assert request(server, 'GET', '/films?list=to_watch&user=bobby')['total'] == 0
+
+    request(server, 'POST', '/users/bobby/lists/to_watch', {'index': 2})
+    films = request(server, 'GET', '/films?list=to_watch&user=bobby')
+    assert films['total'] == 1
+    assert films['rows'][0]['Title'] == 'The Forest'
+    assert request(server, 'GET', '/users/bobby/lists/to_watch')['total'] == 1
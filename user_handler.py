@@ -1,38 +1,30 @@
-import os
-import json
+from metrics import timed
+from user_storage import JsonUserStorage, USERS_JSON_PATH
 
 
 class UserHandler:
-    def __init__(self):
-        self.filepath = 'resources/users/users.json'
-        if not os.path.exists(self.filepath):
-            self.users = []
-            self.save_users()
-
-        self.users = self.load_users()
-
-    def load_users(self):
-        with open(self.filepath, 'r') as file:
-            return json.load(file)
+    def __init__(self, filepath=USERS_JSON_PATH, journaled=False, storage=None):
+        self.storage = storage if storage is not None else JsonUserStorage(filepath, journaled=journaled)
 
+    @timed('save_users', bytes_written=lambda size: size)
     def save_users(self):
-        with open(self.filepath, 'w') as file:
-            json.dump(self.users, file, indent=4)
+        return self.storage.save()
+
+    def close(self):
+        self.storage.close()
 
     def exists(self, username: str):
-        for user in self.users:
-            if username == user['username']:
-                return True
+        return self.storage.exists(username)
 
-        return False
+    def __check_exists(self, username: str):
+        if not self.storage.exists(username):
+            raise ValueError(f'User {username} does not exist')
 
     def get_user_lists(self, username: str):
-        if not self.exists(username):
+        user_lists = self.storage.get_user_lists(username)
+        if user_lists is None:
             raise ValueError(f'User {username} does not exist')
-
-        for user in self.users:
-            if username == user['username']:
-                return user['to_watch'], user['watched']
+        return user_lists
 
     @staticmethod
     def __is_valid_input(username: str, index: int, password=None):
@@ -50,129 +42,105 @@ class UserHandler:
     def is_correct_password(self, username: str, password: str):
         self.__is_valid_input(username, 0, password)
 
-        if not self.exists(username):
+        user_password = self.storage.get_password(username)
+        if user_password is None:
             raise ValueError(f'User {username} does not exist')
-
-        for user in self.users:
-            if username == user['username']:
-                return password == user['password']
+        return password == user_password
 
     def add_user(self, username: str, password: str):
         self.__is_valid_input(username, 0, password)
 
-        if self.exists(username):
-            raise ValueError(f'User {username} already exist')
+        with self.storage.transaction():
+            if self.exists(username):
+                raise ValueError(f'User {username} already exist')
 
-        user_data = {'username': username,
-                     'password': password,
-                     'to_watch': [],
-                     'watched': []}
-        self.users.append(user_data)
-        self.save_users()
+            self.storage.add_user(username, password)
         print(f'User {username} added to users')
 
     def remove_user(self, username: str):
         self.__is_valid_input(username, 0)
 
-        for user in self.users:
-            if user['username'] == username:
-                self.users.remove(user)
-                self.save_users()
-                print(f'User {username} removed from users')
-                return
-
-        raise ValueError(f'User {username} does not exist')
+        with self.storage.transaction():
+            self.__check_exists(username)
+            self.storage.remove_user(username)
+        print(f'User {username} removed from users')
 
     def add_to_watch(self, username: str, index: int):
         self.__is_valid_input(username, index)
 
-        for user in self.users:
-            if user['username'] == username:
-                if index not in user['to_watch'] and index not in user['watched']:
-                    user['to_watch'].append(index)
-                    self.save_users()
-                elif index in user['to_watch']:
-                    raise ValueError(f'Film already added to \'To Watch\'')
-                else:
-                    raise ValueError(f'Film already added to \'Watched\'')
-                return
+        with self.storage.transaction():
+            self.__check_exists(username)
+            in_to_watch = self.storage.contains(username, 'to_watch', index)
+            in_watched = self.storage.contains(username, 'watched', index)
 
-        raise ValueError(f'User {username} does not exist')
+            if not in_to_watch and not in_watched:
+                self.storage.add_to_list(username, 'to_watch', index)
+            elif in_to_watch:
+                raise ValueError(f'Film already added to \'To Watch\'')
+            else:
+                raise ValueError(f'Film already added to \'Watched\'')
 
     def remove_to_watch(self, username: str, index: int):
         self.__is_valid_input(username, index)
 
-        for user in self.users:
-            if user['username'] == username:
-                if index in user['to_watch']:
-                    user['to_watch'].remove(index)
-                    self.save_users()
-                else:
-                    raise ValueError(f'Film index {index} not added to list')
-                return
-
-        raise ValueError(f'User {username} does not exist')
+        with self.storage.transaction():
+            self.__check_exists(username)
+            if self.storage.contains(username, 'to_watch', index):
+                self.storage.remove_from_list(username, 'to_watch', index)
+            else:
+                raise ValueError(f'Film index {index} not added to list')
 
     def add_watched(self, username: str, index: int):
         self.__is_valid_input(username, index)
 
-        for user in self.users:
-            if user['username'] == username:
-                if index not in user['watched'] and index not in user['to_watch']:
-                    user['watched'].append(index)
-                    self.save_users()
-                elif index in user['watched']:
-                    raise ValueError(f'Film already added to \'Watched\'')
-                else:
-                    raise ValueError(f'Film already added to \'To Watch\'')
-                return
+        with self.storage.transaction():
+            self.__check_exists(username)
+            in_to_watch = self.storage.contains(username, 'to_watch', index)
+            in_watched = self.storage.contains(username, 'watched', index)
 
-        raise ValueError(f'User {username} does not exist')
+            if not in_watched and not in_to_watch:
+                self.storage.add_to_list(username, 'watched', index)
+            elif in_watched:
+                raise ValueError(f'Film already added to \'Watched\'')
+            else:
+                raise ValueError(f'Film already added to \'To Watch\'')
 
     def remove_watched(self, username: str, index: int):
         self.__is_valid_input(username, index)
 
-        for user in self.users:
-            if user['username'] == username:
-                if index in user['watched']:
-                    user['watched'].remove(index)
-                    self.save_users()
-                else:
-                    raise ValueError(f'Film index {index} not added to list')
-                return
-
-        raise ValueError(f'User {username} does not exist')
+        with self.storage.transaction():
+            self.__check_exists(username)
+            if self.storage.contains(username, 'watched', index):
+                self.storage.remove_from_list(username, 'watched', index)
+            else:
+                raise ValueError(f'Film index {index} not added to list')
 
     def move_to_watched(self, username: str, index: int):
         self.__is_valid_input(username, index)
 
-        for user in self.users:
-            if user['username'] == username:
-                if index in user['to_watch'] and index not in user['watched']:
-                    user['to_watch'].remove(index)
-                    user['watched'].append(index)
-                    self.save_users()
-                elif index not in user['to_watch']:
-                    raise ValueError(f'Film index {index} not added to list')
-                elif index in user['watched']:
-                    raise ValueError(f'Film index {index} already added to \"Watched\"')
-                return
+        with self.storage.transaction():
+            self.__check_exists(username)
+            in_to_watch = self.storage.contains(username, 'to_watch', index)
+            in_watched = self.storage.contains(username, 'watched', index)
 
-        raise ValueError(f'User {username} does not exist')
+            if in_to_watch and not in_watched:
+                self.storage.move(username, 'to_watch', 'watched', index)
+            elif not in_to_watch:
+                raise ValueError(f'Film index {index} not added to list')
+            elif in_watched:
+                raise ValueError(f'Film index {index} already added to \"Watched\"')
 
     def move_to_towatch(self, username: str, index: int):
         self.__is_valid_input(username, index)
 
-        for user in self.users:
-            if user['username'] == username:
-                if index in user['watched'] and index not in user['to_watch']:
-                    user['watched'].remove(index)
-                    user['to_watch'].append(index)
-                    self.save_users()
-                elif index not in user['to_watch']:
-                    raise ValueError(f'Film index {index} not added to list')
-                elif index in user['watched']:
-                    raise ValueError(f'Film index {index} already added to \"Watched\"')
-                return
-
-        raise ValueError(f'User {username} does not exist')
+        with self.storage.transaction():
+            self.__check_exists(username)
+            in_to_watch = self.storage.contains(username, 'to_watch', index)
+            in_watched = self.storage.contains(username, 'watched', index)
+
+            if in_watched and not in_to_watch:
+                self.storage.move(username, 'watched', 'to_watch', index)
+            elif not in_to_watch:
+                raise ValueError(f'Film index {index} not added to list')
+            elif in_watched:
+                raise ValueError(f'Film index {index} already added to \"Watched\"')
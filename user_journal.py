@@ -0,0 +1,140 @@
+import os
+import json
+import time
+import threading
+
+COMMIT_INTERVAL = 0.05
+COMPACT_THRESHOLD = 10_000
+
+
+def write_json_atomic(path: str, data, indent=4):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(data, file, indent=indent)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+    return os.path.getsize(path)
+
+
+def read_journal_records(path: str):
+    if not os.path.exists(path):
+        return []
+
+    records = []
+    with open(path, 'r') as file:
+        for line in file:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # a torn record can only be the last one written before a crash
+                break
+    return records
+
+
+class UserJournal:
+    def __init__(self, snapshot_path: str, commit_interval=COMMIT_INTERVAL, compact_threshold=COMPACT_THRESHOLD):
+        self.snapshot_path = snapshot_path
+        self.path = snapshot_path + '.journal'
+        self.compacting_path = snapshot_path + '.journal.compacting'
+        self.commit_interval = commit_interval
+        self.compact_threshold = compact_threshold
+
+        self.records = 0
+        self.pending = []
+        self.closed = False
+        self.condition = threading.Condition()
+        self.write_lock = threading.Lock()
+        self.compaction = None
+
+        self.file = open(self.path, 'a')
+        self.flusher = threading.Thread(target=self.__flush_loop, name='user-journal', daemon=True)
+        self.flusher.start()
+
+    def replay_records(self):
+        return read_journal_records(self.compacting_path) + read_journal_records(self.path)
+
+    def append(self, record: dict):
+        with self.condition:
+            self.pending.append(json.dumps(record) + '\n')
+            self.records += 1
+            self.condition.notify()
+
+    def needs_compaction(self):
+        return self.records >= self.compact_threshold and not self.is_compacting()
+
+    def is_compacting(self):
+        return self.compaction is not None and self.compaction.is_alive()
+
+    def flush(self):
+        with self.write_lock:
+            with self.condition:
+                lines, self.pending = self.pending, []
+            if lines:
+                self.file.writelines(lines)
+                self.file.flush()
+                os.fsync(self.file.fileno())
+
+    def __flush_loop(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+            # let more records arrive so they share one fsync
+            time.sleep(self.commit_interval)
+            self.flush()
+
+    def compact(self, snapshot, background=True):
+        if self.is_compacting():
+            self.compaction.join()
+
+        # records written from now on go to a fresh journal, the rotated one is covered by the snapshot
+        with self.write_lock:
+            with self.condition:
+                lines, self.pending = self.pending, []
+                self.records = 0
+            self.file.writelines(lines)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+            self.__rotate()
+            self.file = open(self.path, 'a')
+
+        if background:
+            self.compaction = threading.Thread(target=self.__write_snapshot, args=(snapshot,),
+                                               name='user-journal-compaction')
+            self.compaction.start()
+        else:
+            self.__write_snapshot(snapshot)
+
+    def __rotate(self):
+        if not os.path.exists(self.compacting_path):
+            os.replace(self.path, self.compacting_path)
+            return
+
+        # an earlier compaction did not finish, keep its records until the new snapshot is written
+        with open(self.path, 'r') as journal, open(self.compacting_path, 'a') as compacting:
+            compacting.write(journal.read())
+            compacting.flush()
+            os.fsync(compacting.fileno())
+        os.remove(self.path)
+
+    def __write_snapshot(self, snapshot):
+        write_json_atomic(self.snapshot_path, snapshot)
+        os.remove(self.compacting_path)
+
+    def close(self, snapshot=None):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.flusher.join()
+
+        if snapshot is not None:
+            self.compact(snapshot, background=False)
+        elif self.is_compacting():
+            self.compaction.join()
+
+        self.flush()
+        self.file.close()
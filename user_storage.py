@@ -0,0 +1,290 @@
+import os
+import json
+import atexit
+import sqlite3
+import argparse
+import threading
+from contextlib import contextmanager
+
+from metrics import timed
+from user_journal import UserJournal, write_json_atomic
+
+USERS_JSON_PATH = 'resources/users/users.json'
+USERS_DB_PATH = 'resources/users/users.db'
+USER_LISTS = ('to_watch', 'watched')
+
+
+def open_user_storage(json_path=USERS_JSON_PATH, db_path=USERS_DB_PATH):
+    # a users database is only created on purpose (see import_users_json), so its presence selects the backend
+    if os.path.exists(db_path):
+        return SqliteUserStorage(db_path)
+    return JsonUserStorage(json_path, journaled=True)
+
+
+class JsonUserStorage:
+    def __init__(self, filepath=USERS_JSON_PATH, journaled=False):
+        self.filepath = filepath
+        self.journal = None
+        self.lock = threading.RLock()
+        if not os.path.exists(self.filepath):
+            self.users = {}
+            self.save()
+
+        self.users = self.load()
+
+        if journaled:
+            self.journal = UserJournal(self.filepath)
+            records = self.journal.replay_records()
+            for record in records:
+                self.__apply(record)
+            if records:
+                self.journal.compact(self.snapshot(), background=False)
+            atexit.register(self.close)
+
+    # users are indexed by username and their film lists are kept as insertion-ordered dicts (ordered sets),
+    # the file keeps the original list-of-users format
+    def load(self):
+        with open(self.filepath, 'r') as file:
+            return {user['username']: {'username': user['username'],
+                                       'password': user['password'],
+                                       'to_watch': dict.fromkeys(user['to_watch']),
+                                       'watched': dict.fromkeys(user['watched'])}
+                    for user in json.load(file)}
+
+    def snapshot(self):
+        return [{'username': user['username'],
+                 'password': user['password'],
+                 'to_watch': list(user['to_watch']),
+                 'watched': list(user['watched'])}
+                for user in self.users.values()]
+
+    @timed('user_storage.save', bytes_written=lambda size: size)
+    def save(self):
+        return write_json_atomic(self.filepath, self.snapshot())
+
+    def close(self):
+        if self.journal is not None:
+            atexit.unregister(self.close)
+            self.journal.close(self.snapshot())
+            self.journal = None
+
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            yield
+
+    def exists(self, username: str):
+        return username in self.users
+
+    def get_password(self, username: str):
+        user = self.users.get(username)
+        return None if user is None else user['password']
+
+    def get_user_lists(self, username: str):
+        user = self.users.get(username)
+        return None if user is None else (list(user['to_watch']), list(user['watched']))
+
+    def contains(self, username: str, list_name: str, index: int):
+        return index in self.users[username][list_name]
+
+    def add_user(self, username: str, password: str):
+        self.__mutate({'op': 'add_user', 'username': username, 'password': password})
+
+    def remove_user(self, username: str):
+        self.__mutate({'op': 'remove_user', 'username': username})
+
+    def add_to_list(self, username: str, list_name: str, index: int):
+        self.__mutate({'op': 'add', 'username': username, 'list': list_name, 'index': index})
+
+    def remove_from_list(self, username: str, list_name: str, index: int):
+        self.__mutate({'op': 'remove', 'username': username, 'list': list_name, 'index': index})
+
+    def move(self, username: str, from_list: str, to_list: str, index: int):
+        self.__mutate({'op': 'move', 'username': username, 'from': from_list, 'to': to_list, 'index': index})
+
+    # in journaled mode every mutation is appended to the journal as a small record and the full file is only
+    # rewritten when the journal is compacted
+    def __mutate(self, record: dict):
+        self.__apply(record)
+
+        if self.journal is None:
+            self.save()
+            return
+
+        self.journal.append(record)
+        if self.journal.needs_compaction():
+            self.journal.compact(self.snapshot())
+
+    # replaying a record sets the final state it describes, so records already covered by the snapshot
+    # can be applied again safely
+    def __apply(self, record: dict):
+        if record['op'] == 'add_user':
+            self.users[record['username']] = {'username': record['username'],
+                                              'password': record['password'],
+                                              'to_watch': {},
+                                              'watched': {}}
+            return
+        if record['op'] == 'remove_user':
+            self.users.pop(record['username'], None)
+            return
+
+        user = self.users.get(record['username'])
+        if user is None:
+            return
+
+        match record['op']:
+            case 'add':
+                user[record['list']][record['index']] = None
+            case 'remove':
+                user[record['list']].pop(record['index'], None)
+            case 'move':
+                user[record['from']].pop(record['index'], None)
+                user[record['to']][record['index']] = None
+
+
+class SqliteUserStorage:
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY,
+            username TEXT NOT NULL UNIQUE,
+            password TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS list_items (
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            list TEXT NOT NULL CHECK (list IN ('to_watch', 'watched')),
+            film_index INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            PRIMARY KEY (user_id, film_index, list)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS list_items_by_position ON list_items (user_id, list, position);
+    '''
+
+    def __init__(self, filepath=USERS_DB_PATH, timeout=10.0):
+        self.filepath = filepath
+        self.lock = threading.RLock()
+        self.depth = 0
+
+        self.connection = sqlite3.connect(filepath, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('PRAGMA foreign_keys=ON')
+        self.connection.executescript(self.SCHEMA)
+
+    def save(self):
+        return 0
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    # BEGIN IMMEDIATE takes the database write lock up front, so the checks a UserHandler method makes and the
+    # change it then applies cannot interleave with another process
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            if self.depth == 0:
+                self.connection.execute('BEGIN IMMEDIATE')
+            self.depth += 1
+            try:
+                yield
+            except BaseException:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.connection.execute('ROLLBACK')
+                raise
+            self.depth -= 1
+            if self.depth == 0:
+                self.connection.execute('COMMIT')
+
+    def __query_one(self, sql: str, parameters=()):
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchone()
+
+    def __user_id(self, username: str):
+        row = self.__query_one('SELECT id FROM users WHERE username = ?', (username,))
+        return None if row is None else row[0]
+
+    def exists(self, username: str):
+        return self.__user_id(username) is not None
+
+    def get_password(self, username: str):
+        row = self.__query_one('SELECT password FROM users WHERE username = ?', (username,))
+        return None if row is None else row[0]
+
+    # a single statement reads one snapshot without a transaction, so list reads never take the write lock that
+    # BEGIN IMMEDIATE would and run alongside other readers and a writer
+    def get_user_lists(self, username: str):
+        with self.lock:
+            rows = self.connection.execute('SELECT list, film_index FROM users '
+                                           'LEFT JOIN list_items ON list_items.user_id = users.id '
+                                           'WHERE username = ? ORDER BY list, position', (username,)).fetchall()
+        if not rows:
+            return None
+
+        lists = {list_name: [] for list_name in USER_LISTS}
+        for list_name, index in rows:
+            if list_name is not None:
+                lists[list_name].append(index)
+        return lists['to_watch'], lists['watched']
+
+    def contains(self, username: str, list_name: str, index: int):
+        row = self.__query_one('SELECT 1 FROM list_items JOIN users ON users.id = list_items.user_id '
+                               'WHERE username = ? AND film_index = ? AND list = ?', (username, index, list_name))
+        return row is not None
+
+    def add_user(self, username: str, password: str):
+        with self.transaction():
+            self.connection.execute('INSERT INTO users (username, password) VALUES (?, ?)', (username, password))
+
+    def remove_user(self, username: str):
+        with self.transaction():
+            self.connection.execute('DELETE FROM users WHERE username = ?', (username,))
+
+    def add_to_list(self, username: str, list_name: str, index: int):
+        with self.transaction():
+            user_id = self.__user_id(username)
+            self.connection.execute('INSERT INTO list_items (user_id, list, film_index, position) '
+                                    'SELECT ?, ?, ?, COALESCE(MAX(position), 0) + 1 FROM list_items '
+                                    'WHERE user_id = ? AND list = ?', (user_id, list_name, index, user_id, list_name))
+
+    def remove_from_list(self, username: str, list_name: str, index: int):
+        with self.transaction():
+            self.connection.execute('DELETE FROM list_items WHERE user_id = ? AND film_index = ? AND list = ?',
+                                    (self.__user_id(username), index, list_name))
+
+    def move(self, username: str, from_list: str, to_list: str, index: int):
+        with self.transaction():
+            self.remove_from_list(username, from_list, index)
+            self.add_to_list(username, to_list, index)
+
+    def import_users(self, users: list):
+        with self.transaction():
+            for user in users:
+                self.connection.execute('INSERT OR IGNORE INTO users (username, password) VALUES (?, ?)',
+                                        (user['username'], user['password']))
+                user_id = self.__user_id(user['username'])
+                for list_name in USER_LISTS:
+                    self.connection.executemany(
+                        'INSERT OR IGNORE INTO list_items (user_id, list, film_index, position) VALUES (?, ?, ?, ?)',
+                        [(user_id, list_name, index, position) for position, index in enumerate(user[list_name], 1)])
+
+
+def import_users_json(json_path=USERS_JSON_PATH, db_path=USERS_DB_PATH):
+    # the GUI writes through the journal, so changes not yet compacted into users.json are replayed first
+    source = JsonUserStorage(json_path, journaled=True)
+    source.close()
+    users = source.snapshot()
+
+    storage = SqliteUserStorage(db_path)
+    storage.import_users(users)
+    storage.close()
+    print(f'Imported {len(users)} users from {json_path} into {db_path}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import users.json into the SQLite user storage')
+    parser.add_argument('json_path', nargs='?', default=USERS_JSON_PATH)
+    parser.add_argument('db_path', nargs='?', default=USERS_DB_PATH)
+    args = parser.parse_args()
+
+    import_users_json(args.json_path, args.db_path)
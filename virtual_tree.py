@@ -0,0 +1,127 @@
+from tkinter import ttk
+
+import numpy as np
+
+ROW_BUFFER = 5
+DEFAULT_ROW_HEIGHT = 20
+DEFAULT_HEADER_HEIGHT = 25
+WHEEL_STEP = 3
+
+
+class VirtualTreeview:
+    def __init__(self, tree: ttk.Treeview, scrollbar: ttk.Scrollbar, row_values):
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.row_values = row_values
+
+        self.rows = np.empty(0, dtype=np.intp)
+        self.offset = 0
+        self.visible_rows = 1
+        self.items = []
+        self.selected_position = None
+
+        scrollbar.configure(command=self.yview)
+        tree.configure(yscrollcommand='')
+
+        tree.bind('<Configure>', self.on_resize)
+        tree.bind('<<TreeviewSelect>>', self.on_select)
+        tree.bind('<MouseWheel>', self.on_mouse_wheel)
+        tree.bind('<Button-4>', lambda event: self.scroll(-WHEEL_STEP))
+        tree.bind('<Button-5>', lambda event: self.scroll(WHEEL_STEP))
+        tree.bind('<Up>', lambda event: self.move_selection(-1))
+        tree.bind('<Down>', lambda event: self.move_selection(1))
+        tree.bind('<Prior>', lambda event: self.move_selection(-self.visible_rows))
+        tree.bind('<Next>', lambda event: self.move_selection(self.visible_rows))
+        tree.bind('<Home>', lambda event: self.move_selection(-len(self.rows)))
+        tree.bind('<End>', lambda event: self.move_selection(len(self.rows)))
+
+    def set_rows(self, rows):
+        self.rows = np.asarray(rows)
+        self.offset = 0
+        self.selected_position = None
+        self.refresh()
+
+    def refresh(self):
+        count = max(0, min(self.visible_rows + ROW_BUFFER, len(self.rows) - self.offset))
+
+        while len(self.items) < count:
+            self.items.append(self.tree.insert('', 'end'))
+        while len(self.items) > count:
+            self.tree.delete(self.items.pop())
+
+        values = self.row_values(self.rows[self.offset:self.offset + count])
+        for item, row_values in zip(self.items, values):
+            self.tree.item(item, values=row_values)
+
+        self.tree.yview_moveto(0)
+        self.update_selection()
+        self.update_scrollbar()
+
+    def update_selection(self):
+        slot = None if self.selected_position is None else self.selected_position - self.offset
+        if slot is not None and 0 <= slot < len(self.items):
+            if self.tree.selection() != (self.items[slot],):
+                self.tree.selection_set(self.items[slot])
+            self.tree.focus(self.items[slot])
+        elif self.tree.selection():
+            self.tree.selection_remove(*self.tree.selection())
+
+    def update_scrollbar(self):
+        if len(self.rows) == 0:
+            self.scrollbar.set(0.0, 1.0)
+            return
+        self.scrollbar.set(self.offset / len(self.rows),
+                           min(1.0, (self.offset + self.visible_rows) / len(self.rows)))
+
+    def scroll_to(self, offset: int):
+        offset = max(0, min(offset, len(self.rows) - self.visible_rows))
+        if offset != self.offset:
+            self.offset = offset
+            self.refresh()
+        return 'break'
+
+    def scroll(self, amount: int):
+        return self.scroll_to(self.offset + amount)
+
+    def yview(self, *args):
+        match args:
+            case ('moveto', fraction):
+                self.scroll_to(int(float(fraction) * len(self.rows)))
+            case ('scroll', amount, 'units'):
+                self.scroll(int(amount))
+            case ('scroll', amount, 'pages'):
+                self.scroll(int(amount) * self.visible_rows)
+
+    def move_selection(self, amount: int):
+        if len(self.rows) == 0:
+            return 'break'
+
+        position = self.offset if self.selected_position is None else self.selected_position + amount
+        self.selected_position = max(0, min(position, len(self.rows) - 1))
+
+        if self.selected_position < self.offset:
+            self.scroll_to(self.selected_position)
+        elif self.selected_position >= self.offset + self.visible_rows:
+            self.scroll_to(self.selected_position - self.visible_rows + 1)
+        self.update_selection()
+        return 'break'
+
+    def on_select(self, event=None):
+        selection = self.tree.selection()
+        if selection and selection[0] in self.items:
+            self.selected_position = self.offset + self.items.index(selection[0])
+
+    def on_mouse_wheel(self, event):
+        step = -1 if event.delta > 0 else 1
+        return self.scroll(step * WHEEL_STEP)
+
+    def on_resize(self, event=None):
+        header_height, row_height = DEFAULT_HEADER_HEIGHT, DEFAULT_ROW_HEIGHT
+        if self.items and self.tree.bbox(self.items[0]):
+            _, header_height, _, row_height = self.tree.bbox(self.items[0])
+
+        visible_rows = max(1, (self.tree.winfo_height() - header_height) // max(1, row_height))
+        if visible_rows != self.visible_rows:
+            self.visible_rows = visible_rows
+            self.offset = max(0, min(self.offset, len(self.rows) - self.visible_rows))
+            self.refresh()
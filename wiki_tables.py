@@ -0,0 +1,264 @@
+import os
+import re
+from html.parser import HTMLParser
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+from pandas.io.parsers import TextParser
+
+from metrics import timed
+
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source',
+             'track', 'wbr'}
+SKIPPED_TAGS = {'script', 'style'}
+WHITESPACE_PATTERN = re.compile(r"[\r\n]+|\s{2,}")
+SPAN_PATTERN = re.compile(r"\d+")
+
+
+def is_hidden(attrs: dict):
+    return 'display:none' in (attrs.get('style') or '').replace(' ', '')
+
+
+def has_class(attrs: dict, name: str):
+    return name in (attrs.get('class') or '').split()
+
+
+def parse_span(value):
+    match = SPAN_PATTERN.match(value or '')
+    return int(match.group()) if match else 1
+
+
+# walks a page once and keeps only the text of wikitable cells and of h2 headings, the rest of the document is
+# never turned into a tree
+class WikiTableExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.tables = []
+        self.stack = []
+
+        self.hidden = 0
+        self.skipped = 0
+        self.edit_sections = 0
+
+        self.heading = None
+        self.heading_parts = None
+        self.headline_parts = None
+
+        self.table = None
+        self.nested_tables = 0
+        self.section = 'tbody'
+        self.row = None
+        self.cell = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        markers = set()
+
+        if self.table is not None and self.nested_tables == 0 and not self.hidden:
+            if tag in ('td', 'th', 'tr') and self.cell is not None:
+                self.__close_until('cell')
+            if tag == 'tr' and self.row is not None:
+                self.__close_until('row')
+
+        if is_hidden(attrs):
+            markers.add('hidden')
+            self.hidden += 1
+        if tag in SKIPPED_TAGS:
+            markers.add('skipped')
+            self.skipped += 1
+
+        if tag == 'h2' and self.heading_parts is None:
+            markers.add('h2')
+            self.heading_parts = []
+        elif self.heading_parts is not None and has_class(attrs, 'mw-editsection'):
+            markers.add('edit_section')
+            self.edit_sections += 1
+        elif self.heading_parts is not None and self.headline_parts is None and has_class(attrs, 'mw-headline'):
+            markers.add('headline')
+            self.headline_parts = []
+
+        if tag == 'table':
+            if self.table is not None:
+                markers.add('nested_table')
+                self.nested_tables += 1
+            elif not self.hidden and has_class(attrs, 'wikitable'):
+                markers.add('table')
+                self.table = {'heading': self.heading, 'thead': [], 'tbody': [], 'tfoot': []}
+                self.section = 'tbody'
+        elif self.table is not None and self.nested_tables == 0 and not self.hidden:
+            if tag in ('thead', 'tbody', 'tfoot'):
+                markers.add('section')
+                self.section = tag
+            elif tag == 'tr':
+                markers.add('row')
+                self.row = []
+            elif tag in ('td', 'th') and self.row is not None:
+                markers.add('cell')
+                self.cell = (tag, parse_span(attrs.get('rowspan')), parse_span(attrs.get('colspan')), [])
+
+        if tag not in VOID_TAGS:
+            self.stack.append((tag, markers))
+        else:
+            self.__close(markers)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if any(open_tag == tag for open_tag, _ in self.stack):
+            while self.stack:
+                open_tag, markers = self.stack.pop()
+                self.__close(markers)
+                if open_tag == tag:
+                    break
+
+    def handle_data(self, data):
+        if self.hidden or self.skipped:
+            return
+        if self.heading_parts is not None and not self.edit_sections:
+            self.heading_parts.append(data)
+            if self.headline_parts is not None:
+                self.headline_parts.append(data)
+        if self.cell is not None:
+            self.cell[3].append(data)
+
+    def close(self):
+        super().close()
+        while self.stack:
+            self.__close(self.stack.pop()[1])
+        return self.tables
+
+    def __close_until(self, marker: str):
+        while self.stack:
+            _, markers = self.stack.pop()
+            self.__close(markers)
+            if marker in markers:
+                break
+
+    def __close(self, markers: set):
+        if 'cell' in markers:
+            tag, rowspan, colspan, parts = self.cell
+            self.row.append((tag, WHITESPACE_PATTERN.sub(' ', ''.join(parts).strip()), rowspan, colspan))
+            self.cell = None
+        if 'row' in markers:
+            self.table[self.section].append(self.row)
+            self.row = None
+        if 'section' in markers:
+            self.section = 'tbody'
+        if 'table' in markers:
+            self.tables.append(self.table)
+            self.table = None
+        if 'nested_table' in markers:
+            self.nested_tables -= 1
+        if 'headline' in markers:
+            self.heading = ''.join(self.headline_parts).strip()
+        if 'edit_section' in markers:
+            self.edit_sections -= 1
+        if 'h2' in markers:
+            if self.headline_parts is None:
+                self.heading = ''.join(self.heading_parts).strip()
+            self.heading_parts = None
+            self.headline_parts = None
+        if 'skipped' in markers:
+            self.skipped -= 1
+        if 'hidden' in markers:
+            self.hidden -= 1
+
+
+# same rules as pandas.read_html: rowspan and colspan cells are copied into the cells they cover
+def expand_spans(rows: list, remainder=None, overflow=True):
+    texts_by_row = []
+    remainder = remainder if remainder is not None else []
+
+    for row in rows:
+        texts = []
+        next_remainder = []
+        index = 0
+        for _, text, rowspan, colspan in row:
+            while remainder and remainder[0][0] <= index:
+                previous_index, previous_text, previous_rowspan = remainder.pop(0)
+                texts.append(previous_text)
+                if previous_rowspan > 1:
+                    next_remainder.append((previous_index, previous_text, previous_rowspan - 1))
+                index += 1
+
+            for _ in range(colspan):
+                texts.append(text)
+                if rowspan > 1:
+                    next_remainder.append((index, text, rowspan - 1))
+                index += 1
+
+        for previous_index, previous_text, previous_rowspan in remainder:
+            texts.append(previous_text)
+            if previous_rowspan > 1:
+                next_remainder.append((previous_index, previous_text, previous_rowspan - 1))
+
+        texts_by_row.append(texts)
+        remainder = next_remainder
+
+    if not overflow:
+        while remainder:
+            texts_by_row.append([text for _, text, _ in remainder])
+            remainder = [(index, text, rowspan - 1) for index, text, rowspan in remainder if rowspan > 1]
+
+    return texts_by_row, remainder
+
+
+def table_to_frame(table: dict):
+    head_rows, body_rows, foot_rows = table['thead'], list(table['tbody']), table['tfoot']
+    if not head_rows:
+        head_rows = []
+        while body_rows and all(tag == 'th' for tag, *_ in body_rows[0]):
+            head_rows.append(body_rows.pop(0))
+
+    head, remainder = expand_spans(head_rows)
+    body, remainder = expand_spans(body_rows, remainder, overflow=len(foot_rows) > 0)
+    foot, _ = expand_spans(foot_rows, remainder, overflow=False)
+
+    header = None
+    if head:
+        body = head + body
+        header = 0 if len(head) == 1 else [i for i, row in enumerate(head) if any(row)]
+    body += foot
+    if not body:
+        return None
+
+    width = max(len(row) for row in body)
+    for row in body:
+        row.extend([''] * (width - len(row)))
+
+    with TextParser(body, header=header, thousands=',') as parser:
+        return parser.read()
+
+
+def parse_page(content: bytes):
+    extractor = WikiTableExtractor()
+    extractor.feed(content.decode('utf-8', errors='replace'))
+
+    dataframes = []
+    for table in extractor.close():
+        df = table_to_frame(table)
+        if df is None:
+            continue
+
+        movie_type = table['heading']
+        df['Type'] = movie_type
+        if movie_type == "Documentaries":
+            df['Genre'] = 'Documentary'
+
+        dataframes.append(df)
+    return dataframes
+
+
+@timed('parse_pages', rows_in=lambda pages, *args, **kwargs: len(pages), rows_out=len)
+def parse_pages(pages: list, max_workers=None):
+    workers = min(len(pages), max_workers or os.cpu_count() or 1)
+    if workers <= 1:
+        frames_by_page = [parse_page(page) for page in pages]
+    else:
+        with ProcessPoolExecutor(workers) as executor:
+            frames_by_page = list(executor.map(parse_page, pages))
+
+    return pd.concat([df for frames in frames_by_page for df in frames], ignore_index=True)